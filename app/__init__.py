@@ -1,6 +1,22 @@
 from flask import Flask
 from app.config import load_configurations, configure_logging
-from .views import webhook_blueprint
+from .views import debug_blueprint, metrics_blueprint, webhook_blueprint
+from .utils.graph_client import graph_client
+from .utils.gemini_utils import init_gemini
+from .utils.broadcast import seed_recipients
+from .utils.dedup import deduplicator
+from .utils.leader import leader
+from .utils.ledger import money_ledger
+from .utils.metrics import metrics
+from .utils.profiling import profiler
+from .utils.read_receipts import read_receipts
+from .utils.resilience import external_services
+from .utils.scheduler import scheduler
+from .utils.sheets import init_sheets
+from .utils.status_store import status_store
+from .utils.warm_up import start_warm_up
+from .utils.youtube_mp3 import mp3_converter
+from .utils.whatsapp_utils import register_counter_commands, reminder_dispatcher, schedule_daily_pushes
 
 
 def create_app():
@@ -9,8 +25,34 @@ def create_app():
     # Load configurations and logging settings
     load_configurations(app)
     configure_logging()
+    external_services.init_app(app)
+    graph_client.init_app(app)
+    deduplicator.init_app(app)
+    init_gemini(app)
+    init_sheets(app)
+    mp3_converter.init_app(app)
+    read_receipts.init_app(app)
+    profiler.init_app(app)
+    reminder_dispatcher.init_app(app)
+    status_store.init_app(app, scheduler)
+    metrics.init_app(app, scheduler)
+    money_ledger.init_app(app, scheduler, leader)
+    register_counter_commands(app.config["COUNTER_SETS"])
+    seed_recipients("all", app.config["BROADCAST_RECIPIENTS"])
+    start_warm_up(app)
+
+    # Background jobs are started explicitly here, never as an import side effect.
+    # The scheduler always runs because every process flushes its own statuses
+    # and metrics; SCHEDULER_ENABLED only decides whether it competes for the
+    # leader lock that guards the daily pushes and the money ledger flush.
+    if app.config["SCHEDULER_ENABLED"]:
+        leader.init_app(app, scheduler)
+        schedule_daily_pushes(app)
+    scheduler.start()
 
     # Import and register blueprints, if any
     app.register_blueprint(webhook_blueprint)
+    app.register_blueprint(metrics_blueprint)
+    app.register_blueprint(debug_blueprint)
 
     return app
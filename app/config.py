@@ -1,5 +1,6 @@
 import sys
 import os
+import json
 from dotenv import load_dotenv
 import logging
 
@@ -15,6 +16,159 @@ def load_configurations(app):
     app.config["PHONE_NUMBER_ID"] = os.getenv("PHONE_NUMBER_ID")
     app.config["VERIFY_TOKEN"] = os.getenv("VERIFY_TOKEN")
     app.config["GEMINI_API_KEY"] = os.getenv("GEMINI_API_KEY")
+    app.config["GEMINI_MODEL"] = os.getenv("GEMINI_MODEL", "gemini-pro")
+    # Upstream API locations, only changed to point the bot at local stand-ins (benchmarks/webhook_replay.py)
+    app.config["GRAPH_API_BASE_URL"] = os.getenv("GRAPH_API_BASE_URL", "https://graph.facebook.com")
+    app.config["GEMINI_API_ENDPOINT"] = os.getenv("GEMINI_API_ENDPOINT")
+    app.config["STABILITY_API_BASE_URL"] = os.getenv("STABILITY_API_BASE_URL", "https://api.stability.ai")
+    app.config["UNSPLASH_API_BASE_URL"] = os.getenv("UNSPLASH_API_BASE_URL", "https://api.unsplash.com")
+    app.config["RAPIDAPI_BASE_URL"] = os.getenv("RAPIDAPI_BASE_URL", "https://youtube-mp3-downloader2.p.rapidapi.com")
+    app.config["SHEETS_API_BASE_URL"] = os.getenv("SHEETS_API_BASE_URL")
+    # Conversation memory for /ai, per wa_id
+    app.config["GEMINI_HISTORY_TOKEN_BUDGET"] = int(os.getenv("GEMINI_HISTORY_TOKEN_BUDGET", "2000"))
+    app.config["GEMINI_HISTORY_TTL"] = int(os.getenv("GEMINI_HISTORY_TTL", "21600"))
+    # Send /ai replies progressively, flushing at paragraph/sentence boundaries past this many characters
+    app.config["GEMINI_STREAMING"] = os.getenv("GEMINI_STREAMING", "false").lower() == "true"
+    app.config["GEMINI_STREAM_MIN_CHUNK"] = int(os.getenv("GEMINI_STREAM_MIN_CHUNK", "300"))
+    # Opt-in reply cache for standalone /ai questions (in-process LRU + Redis)
+    app.config["GEMINI_CACHE_ENABLED"] = os.getenv("GEMINI_CACHE_ENABLED", "false").lower() == "true"
+    app.config["GEMINI_CACHE_TTL"] = int(os.getenv("GEMINI_CACHE_TTL", "86400"))
+    app.config["GEMINI_CACHE_SIZE"] = int(os.getenv("GEMINI_CACHE_SIZE", "512"))
+    app.config["GEMINI_CACHE_BYPASS_COMMANDS"] = {
+        command.strip().casefold()
+        for command in os.getenv("GEMINI_CACHE_BYPASS_COMMANDS", "").split(",")
+        if command.strip()
+    }
+    # Messages are marked read (with a typing indicator) as soon as they are accepted;
+    # one receipt per sender covers every message arriving within READ_RECEIPT_WINDOW seconds
+    app.config["READ_RECEIPTS_ENABLED"] = os.getenv("READ_RECEIPTS_ENABLED", "true").lower() == "true"
+    app.config["TYPING_INDICATOR_ENABLED"] = os.getenv("TYPING_INDICATOR_ENABLED", "true").lower() == "true"
+    app.config["READ_RECEIPT_WINDOW"] = float(os.getenv("READ_RECEIPT_WINDOW", "1"))
+    app.config["GRAPH_POOL_SIZE"] = int(os.getenv("GRAPH_POOL_SIZE", "100"))
+    # Requests per second per PHONE_NUMBER_ID across all processes, 0 disables the limiter
+    app.config["GRAPH_RATE_LIMIT"] = float(os.getenv("GRAPH_RATE_LIMIT", "50"))
+    app.config["GRAPH_RATE_BURST"] = float(os.getenv("GRAPH_RATE_BURST", os.getenv("GRAPH_RATE_LIMIT", "50")))
+    app.config["GRAPH_MAX_RETRIES"] = int(os.getenv("GRAPH_MAX_RETRIES", "3"))
+    app.config["GRAPH_RETRY_BASE_DELAY"] = float(os.getenv("GRAPH_RETRY_BASE_DELAY", "0.5"))
+    app.config["GRAPH_RETRY_MAX_DELAY"] = float(os.getenv("GRAPH_RETRY_MAX_DELAY", "30"))
+
+    # "inline" processes messages inside the webhook request, "queue" hands them to worker.py
+    app.config["PROCESSING_MODE"] = os.getenv("PROCESSING_MODE", "inline")
+    app.config["WEBHOOK_QUEUE_KEY"] = os.getenv("WEBHOOK_QUEUE_KEY", "whatsapp:webhooks")
+    app.config["WORKER_CONCURRENCY"] = int(os.getenv("WORKER_CONCURRENCY", "4"))
+    # A worker silent for this long is considered dead and its in-progress items are requeued
+    app.config["WORKER_HEARTBEAT_TTL"] = int(os.getenv("WORKER_HEARTBEAT_TTL", "30"))
+
+    # Webhook message dedup: "keys" (one key per ID), "buckets" (hourly sets) or "bloom" (Bloom filters)
+    app.config["DEDUP_MODE"] = os.getenv("DEDUP_MODE", "keys")
+    app.config["DEDUP_TTL"] = int(os.getenv("DEDUP_TTL", "43200"))
+    app.config["DEDUP_BUCKET_SECONDS"] = int(os.getenv("DEDUP_BUCKET_SECONDS", "3600"))
+    app.config["DEDUP_EXPECTED_MESSAGES"] = int(os.getenv("DEDUP_EXPECTED_MESSAGES", "100000"))
+    app.config["DEDUP_FALSE_POSITIVE_RATE"] = float(os.getenv("DEDUP_FALSE_POSITIVE_RATE", "0.001"))
+    app.config["DEDUP_LOCAL_CACHE_SIZE"] = int(os.getenv("DEDUP_LOCAL_CACHE_SIZE", "10000"))
+
+    # Delivery statuses (sent/delivered/read/failed) are buffered and written to Redis in batches
+    app.config["STATUS_BATCH_SIZE"] = int(os.getenv("STATUS_BATCH_SIZE", "200"))
+    app.config["STATUS_FLUSH_INTERVAL"] = float(os.getenv("STATUS_FLUSH_INTERVAL", "2"))
+    app.config["STATUS_TTL"] = int(os.getenv("STATUS_TTL", "604800"))
+
+    # Broadcasts (/all) fan out concurrently, capped at BROADCAST_RATE messages per second
+    app.config["BROADCAST_RATE"] = float(os.getenv("BROADCAST_RATE", "20"))
+    app.config["BROADCAST_CONCURRENCY"] = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+    app.config["BROADCAST_RESULTS_TTL"] = int(os.getenv("BROADCAST_RESULTS_TTL", "604800"))
+    # Seeds the "all" broadcast group, more groups live in Redis sets broadcast:group:<name>
+    app.config["BROADCAST_RECIPIENTS"] = [
+        wa_id.strip() for wa_id in os.getenv("BROADCAST_RECIPIENTS", "").split(",") if wa_id.strip()
+    ]
+
+    # /image fetches a page of Unsplash results per query and rotates through it from Redis;
+    # uncached searches stop while no more than UNSPLASH_RATE_LIMIT_RESERVE requests are left this hour
+    app.config["UNSPLASH_PAGE_SIZE"] = int(os.getenv("UNSPLASH_PAGE_SIZE", "10"))
+    app.config["UNSPLASH_CACHE_TTL"] = int(os.getenv("UNSPLASH_CACHE_TTL", "86400"))
+    app.config["UNSPLASH_RATE_LIMIT_RESERVE"] = int(os.getenv("UNSPLASH_RATE_LIMIT_RESERVE", "5"))
+
+    # /youtubemp3 download links are cached per video ID; identical conversions running
+    # at the same time share one upstream call
+    app.config["RAPIDAPI_KEY"] = os.getenv("RAPIDAPI_KEY")
+    app.config["YOUTUBE_MP3_CACHE_TTL"] = int(os.getenv("YOUTUBE_MP3_CACHE_TTL", "3600"))
+
+    # /gen images are cached by prompt as WhatsApp media IDs, which Meta keeps for 30 days
+    app.config["GEN_CACHE_TTL"] = int(os.getenv("GEN_CACHE_TTL", "604800"))
+
+    # Counter commands: {"<command>": {"<label>": ["<alias>", ...]}}, counts live in Redis hashes counters:<command>
+    app.config["COUNTER_SETS"] = json.loads(
+        os.getenv("COUNTER_SETS")
+        or '{"chaitanya": {"Cold Drink": ["colddrink", "cold drink"], "Chips": ["chips"], '
+        '"Ice Cream": ["icecream", "ice cream"]}}'
+    )
+
+    # /money balance lives in Redis, changes are copied to this Google Sheet in the background
+    app.config["MONEY_SHEET_ID"] = os.getenv("MONEY_SHEET_ID", "Google_Sheet_ID_Here")
+    app.config["MONEY_BALANCE_RANGE"] = os.getenv("MONEY_BALANCE_RANGE", "A1:A1")
+    app.config["MONEY_LOG_RANGE"] = os.getenv("MONEY_LOG_RANGE", "Log!A:F")
+    app.config["MONEY_FLUSH_INTERVAL"] = float(os.getenv("MONEY_FLUSH_INTERVAL", "30"))
+    app.config["MONEY_FLUSH_BATCH"] = int(os.getenv("MONEY_FLUSH_BATCH", "500"))
+
+    # Reminders are stored in Redis and fired by a dispatcher thread, safe to run in every process
+    app.config["REMINDER_DISPATCHER_ENABLED"] = os.getenv("REMINDER_DISPATCHER_ENABLED", "true").lower() == "true"
+    app.config["REMINDER_BATCH_SIZE"] = int(os.getenv("REMINDER_BATCH_SIZE", "100"))
+    app.config["REMINDER_LEASE_SECONDS"] = int(os.getenv("REMINDER_LEASE_SECONDS", "60"))
+
+    # Counters and histograms are buffered per process and added to Redis every
+    # METRICS_FLUSH_INTERVAL seconds; GET /metrics needs "Bearer <METRICS_TOKEN>" when it is set
+    app.config["METRICS_ENABLED"] = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    app.config["METRICS_FLUSH_INTERVAL"] = float(os.getenv("METRICS_FLUSH_INTERVAL", "10"))
+    app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN")
+
+    # Sampling profiler for webhook requests: PROFILE_SAMPLE_RATE of requests while PROFILING_ENABLED,
+    # plus any request with an X-Admin-Signature signed with PROFILING_SECRET (which also guards /debug/profiles)
+    app.config["PROFILING_ENABLED"] = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    app.config["PROFILE_SAMPLE_RATE"] = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+    app.config["PROFILE_INTERVAL_MS"] = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+    app.config["PROFILE_DIR"] = os.getenv("PROFILE_DIR", "profiles")
+    app.config["PROFILE_MAX_FILES"] = int(os.getenv("PROFILE_MAX_FILES", "200"))
+    app.config["PROFILING_SECRET"] = os.getenv("PROFILING_SECRET")
+
+    # Every upstream API gets a timeout (seconds) and a cap on concurrent calls (bulkhead);
+    # BREAKER_FAILURE_THRESHOLD consecutive failures open its circuit breaker, which fails
+    # fast for BREAKER_RESET_TIMEOUT seconds before letting one trial call through
+    app.config["EXTERNAL_SERVICES"] = {
+        name: {
+            "timeout": float(os.getenv(f"{name.upper()}_TIMEOUT", timeout)),
+            "max_concurrency": int(os.getenv(f"{name.upper()}_MAX_CONCURRENCY", max_concurrency)),
+        }
+        for name, timeout, max_concurrency in [
+            ("graph", "10", "100"),
+            ("stability", "60", "4"),
+            ("unsplash", "10", "8"),
+            ("rapidapi", "45", "8"),
+            ("sheets", "15", "4"),
+            ("gemini", "60", "16"),
+        ]
+    }
+    app.config["BREAKER_FAILURE_THRESHOLD"] = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+    app.config["BREAKER_RESET_TIMEOUT"] = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+    # Slow clients (Gemini SDK, Sheets, Redis) are built lazily; warm them up in the
+    # "background" (default), "eager"ly before serving, or "off" to build on first use
+    app.config["WARM_UP"] = os.getenv("WARM_UP", "background").lower()
+
+    # Scheduled jobs, times are "HH:MM" in TIMEZONE
+    app.config["SCHEDULER_ENABLED"] = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+    # Jobs that must run once across all processes (e.g. daily pushes) only run in the lock holder
+    app.config["LEADER_LOCK_KEY"] = os.getenv("LEADER_LOCK_KEY", "leader:background")
+    app.config["LEADER_LOCK_TTL"] = int(os.getenv("LEADER_LOCK_TTL", "30"))
+    app.config["TIMEZONE"] = os.getenv("TIMEZONE", "Asia/Kolkata")
+    app.config["PUSH_RECIPIENTS"] = [
+        wa_id.strip()
+        # An empty PUSH_RECIPIENTS (as in .env.example) falls back too, not just a missing one
+        for wa_id in (os.getenv("PUSH_RECIPIENTS") or os.getenv("RECIPIENT_WAID") or "").split(",")
+        if wa_id.strip()
+    ]
+    app.config["MESS_MENU_IMAGE_URL"] = os.getenv("MESS_MENU_IMAGE_URL")
+    app.config["MESS_MENU_PUSH_TIME"] = os.getenv("MESS_MENU_PUSH_TIME")
+    app.config["TIMETABLE_IMAGE_URL"] = os.getenv("TIMETABLE_IMAGE_URL")
+    app.config["TIMETABLE_PUSH_TIME"] = os.getenv("TIMETABLE_PUSH_TIME")
 
 def configure_logging():
     logging.basicConfig(
@@ -1,18 +1,29 @@
-from functools import wraps
+from functools import lru_cache, wraps
 from flask import current_app, jsonify, request
 import logging
 import hashlib
 import hmac
 
+from ..utils.profiling import verify_admin_signature
+
+
+@lru_cache(maxsize=4)
+def get_signing_key(app_secret):
+    return bytes(app_secret, "latin-1")
+
 
 def validate_signature(payload, signature):
     """
-    Validate the incoming payload's signature against our expected signature
+    Validate the incoming payload's signature against our expected signature.
+    The payload is the raw request body as bytes, exactly as Meta signed it.
     """
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+
     # Use the App Secret to hash the payload
     expected_signature = hmac.new(
-        bytes(current_app.config["APP_SECRET"], "latin-1"),
-        msg=payload.encode("utf-8"),
+        get_signing_key(current_app.config["APP_SECRET"]),
+        msg=payload,
         digestmod=hashlib.sha256,
     ).hexdigest()
 
@@ -30,9 +41,41 @@ def signature_required(f):
         signature = request.headers.get("X-Hub-Signature-256", "")[
             7:
         ]  # Removing 'sha256='
-        if not validate_signature(request.data.decode("utf-8"), signature):
+        # get_data() caches the body, so the view parses these same bytes without copying them again
+        if not validate_signature(request.get_data(), signature):
             logging.info("Signature verification failed!")
             return jsonify({"status": "error", "message": "Invalid signature"}), 403
         return f(*args, **kwargs)
 
     return decorated_function
+
+
+def admin_signature_required(f):
+    """
+    Decorator requiring an X-Admin-Signature header signed with PROFILING_SECRET (see profiling.py).
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not verify_admin_signature(request.headers.get("X-Admin-Signature"), current_app.config["PROFILING_SECRET"]):
+            return jsonify({"status": "error", "message": "Invalid admin signature"}), 403
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def metrics_token_required(f):
+    """
+    Decorator requiring `Authorization: Bearer <METRICS_TOKEN>` when METRICS_TOKEN is set.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = current_app.config["METRICS_TOKEN"]
+        if token:
+            provided = request.headers.get("Authorization", "").removeprefix("Bearer ")
+            if not hmac.compare_digest(provided.encode("utf-8"), token.encode("utf-8")):
+                return jsonify({"status": "error", "message": "Invalid metrics token"}), 401
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import threading
+
+
+class AsyncioRuntime:
+    """
+    One long-lived event loop running in a daemon thread.
+
+    Sync code hands coroutines to it with `submit` (fire and forget, returns a
+    concurrent.futures.Future) or `run` (submit and wait for the result).
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        # The loop thread does not survive fork(), a forked worker starts its own on first use
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    self._thread = threading.Thread(
+                        target=loop.run_forever, name="asyncio-runtime", daemon=True
+                    )
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine, timeout=None):
+        if threading.current_thread() is self._thread:
+            coroutine.close()
+            raise RuntimeError("AsyncioRuntime.run() would block its own event loop, await instead")
+        return self.submit(coroutine).result(timeout)
+
+
+runtime = AsyncioRuntime()
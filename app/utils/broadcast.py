@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+import uuid
+
+from .async_runtime import runtime
+from .redis_utils import get_redis_client
+
+
+def _group_key(group):
+    return f"broadcast:group:{group}"
+
+
+def _broadcast_key(broadcast_id):
+    return f"broadcast:{broadcast_id}"
+
+
+def _results_key(broadcast_id):
+    return f"broadcast:{broadcast_id}:results"
+
+
+# group -> WA IDs still to be added before the group is next read
+_seeds = {}
+
+
+def add_recipients(group, wa_ids):
+    if wa_ids:
+        get_redis_client().sadd(_group_key(group), *wa_ids)
+
+
+def remove_recipients(group, wa_ids):
+    if wa_ids:
+        get_redis_client().srem(_group_key(group), *wa_ids)
+
+
+def seed_recipients(group, wa_ids):
+    """
+    Add `wa_ids` to a group the first time it is read, so startup doesn't need Redis.
+    """
+    if wa_ids:
+        _seeds[group] = list(wa_ids)
+
+
+def get_recipients(group):
+    wa_ids = _seeds.pop(group, None)
+    if wa_ids:
+        try:
+            add_recipients(group, wa_ids)
+        except Exception:
+            # Retried on the next read
+            _seeds.setdefault(group, wa_ids)
+            raise
+    return sorted(wa_id.decode("utf-8") for wa_id in get_redis_client().smembers(_group_key(group)))
+
+
+class TokenBucket:
+    """
+    Async token bucket: allows `rate` acquisitions per second with bursts of up to `burst`.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def record_results(broadcast_id, results, ttl):
+    sent = sum(1 for status in results.values() if status == "sent")
+
+    pipeline = get_redis_client().pipeline()
+    if results:
+        pipeline.hset(_results_key(broadcast_id), mapping=results)
+        pipeline.expire(_results_key(broadcast_id), ttl)
+    pipeline.hset(
+        _broadcast_key(broadcast_id),
+        mapping={"state": "done", "sent": sent, "failed": len(results) - sent, "finished_at": int(time.time())},
+    )
+    pipeline.expire(_broadcast_key(broadcast_id), ttl)
+    pipeline.execute()
+    return sent
+
+
+async def run_broadcast(broadcast_id, recipients, build_message, send, rate, concurrency, results_ttl):
+    """
+    Send `build_message(wa_id)` to every recipient, at most `concurrency` in
+    flight and `rate` per second, then store each recipient's outcome.
+    """
+    bucket = TokenBucket(rate, burst=concurrency)
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def deliver(wa_id):
+        async with in_flight:
+            await bucket.acquire()
+            try:
+                status, _ = await send(build_message(wa_id))
+            except Exception:
+                logging.exception(f"Broadcast {broadcast_id} failed for {wa_id}")
+                status = None
+            return wa_id, "sent" if status == 200 else f"failed:{status}"
+
+    results = dict(await asyncio.gather(*(deliver(wa_id) for wa_id in recipients)))
+
+    loop = asyncio.get_running_loop()
+    sent = await loop.run_in_executor(None, record_results, broadcast_id, results, results_ttl)
+    logging.info(f"Broadcast {broadcast_id} finished: {sent}/{len(results)} sent")
+
+
+def start_broadcast(group, build_message, send, rate, concurrency, results_ttl):
+    """
+    Start broadcasting to a recipient group in the background.
+
+    Returns (broadcast_id, recipient_count) without waiting for delivery;
+    progress and per-recipient results are kept under broadcast:<id> in Redis.
+    """
+    recipients = get_recipients(group)
+    broadcast_id = uuid.uuid4().hex[:12]
+
+    get_redis_client().hset(
+        _broadcast_key(broadcast_id),
+        mapping={"group": group, "state": "sending", "recipients": len(recipients), "started_at": int(time.time())},
+    )
+    if recipients:
+        runtime.submit(
+            run_broadcast(broadcast_id, recipients, build_message, send, rate, concurrency, results_ttl)
+        )
+    else:
+        record_results(broadcast_id, {}, results_ttl)
+
+    return broadcast_id, len(recipients)
@@ -0,0 +1,67 @@
+import re
+from collections import namedtuple
+
+
+Command = namedtuple("Command", ["name", "handler", "aliases"])
+
+# A command is the leading "/word" of a message, e.g. "/ai" in "/ai: what is redis?"
+COMMAND_TOKEN_PATTERN = re.compile(r"\s*(/\w+)")
+
+
+def split_command(message_body):
+    """
+    Split a message into its leading command token and the remaining text.
+
+    Returns (None, message_body) when the message does not start with a command.
+    """
+    match = COMMAND_TOKEN_PATTERN.match(message_body)
+    if match is None:
+        return None, message_body
+    return match.group(1), message_body[match.end():].lstrip(" :,-\n").strip()
+
+
+def command_args(message_body):
+    return split_command(message_body)[1]
+
+
+class CommandRouter:
+    """
+    Registry of bot commands indexed by alias.
+
+    Aliases are matched case-insensitively against the leading token of a
+    message only, so "/gen" and "/generate" or "/m" and "/money" can't shadow
+    each other and resolving a message is a single dict lookup.
+    """
+
+    def __init__(self):
+        self._index = {}
+        self.commands = {}
+
+    def register(self, name, aliases, handler):
+        command = Command(name, handler, tuple(aliases))
+        for alias in aliases:
+            for key in (alias, alias.casefold()):
+                existing = self._index.get(key)
+                if existing is not None and existing.name != name:
+                    raise ValueError(f"Alias {alias} is already registered to /{existing.name}")
+                self._index[key] = command
+        self.commands[name] = command
+        return command
+
+    def command(self, name, *aliases):
+        def decorator(handler):
+            self.register(name, aliases, handler)
+            return handler
+
+        return decorator
+
+    def resolve(self, message_body):
+        # Fast path: "/alias rest of message" exactly as declared
+        command = self._index.get(message_body.partition(" ")[0])
+        if command is not None:
+            return command
+
+        token, _ = split_command(message_body)
+        if token is None:
+            return None
+        return self._index.get(token.casefold())
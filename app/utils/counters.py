@@ -0,0 +1,47 @@
+from .redis_utils import get_redis_client
+
+
+def _counters_key(name):
+    return f"counters:{name}"
+
+
+class CounterSet:
+    """
+    Named counters kept together in one Redis hash, `counters:<name>`.
+
+    `counters` maps each counter's label (also its hash field) to the names
+    users can type for it, e.g. {"Cold Drink": ["colddrink", "cold drink"]}.
+    Increments are HINCRBY, so they are atomic across threads and processes.
+    """
+
+    def __init__(self, name, counters):
+        self.name = name
+        self.labels = list(counters)
+        self._aliases = {}
+        for label, aliases in counters.items():
+            for alias in [label, *aliases]:
+                self._aliases[self._normalize(alias)] = label
+
+    @staticmethod
+    def _normalize(alias):
+        return " ".join(alias.split()).casefold()
+
+    def resolve(self, alias):
+        return self._aliases.get(self._normalize(alias))
+
+    def get_counts(self):
+        values = get_redis_client().hmget(_counters_key(self.name), self.labels)
+        return {label: int(value or 0) for label, value in zip(self.labels, values)}
+
+    def increment(self, label, amount):
+        """
+        Add `amount` to one counter and return all counts, in one round trip.
+        """
+        pipeline = get_redis_client().pipeline()
+        pipeline.hincrby(_counters_key(self.name), label, amount)
+        pipeline.hmget(_counters_key(self.name), self.labels)
+        _, values = pipeline.execute()
+        return {label: int(value or 0) for label, value in zip(self.labels, values)}
+
+    def format_counts(self, counts):
+        return "\n".join(f"{label}: {counts[label]}" for label in self.labels)
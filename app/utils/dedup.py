@@ -0,0 +1,181 @@
+import hashlib
+import math
+import threading
+import time
+
+from .lru_cache import LRUCache
+from .metrics import metrics
+from .redis_utils import get_redis_client
+
+DEDUP_RESULTS = metrics.counter(
+    "whatsapp_dedup_total", "Webhook message IDs checked, by result (local_hits, redis_hits, new)."
+)
+
+# KEYS are the bucket sets, newest first. ARGV[1] is the TTL of the newest
+# bucket, the rest are message IDs. Returns 1 for new IDs, 0 for duplicates.
+BUCKETS_SCRIPT = """
+local result = {}
+for i = 2, #ARGV do
+    local seen = false
+    for _, key in ipairs(KEYS) do
+        if redis.call('SISMEMBER', key, ARGV[i]) == 1 then
+            seen = true
+            break
+        end
+    end
+    if not seen then
+        redis.call('SADD', KEYS[1], ARGV[i])
+    end
+    result[#result + 1] = seen and 0 or 1
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return result
+"""
+
+# Same as above with a Bloom filter (a bitmap) per bucket. ARGV[2] is the
+# number of hashes k, followed by k bit offsets per message ID.
+BLOOM_SCRIPT = """
+local k = tonumber(ARGV[2])
+local result = {}
+for i = 3, #ARGV, k do
+    local seen = false
+    for _, key in ipairs(KEYS) do
+        local all_set = true
+        for j = 0, k - 1 do
+            if redis.call('GETBIT', key, ARGV[i + j]) == 0 then
+                all_set = false
+                break
+            end
+        end
+        if all_set then
+            seen = true
+            break
+        end
+    end
+    if not seen then
+        for j = 0, k - 1 do
+            redis.call('SETBIT', KEYS[1], ARGV[i + j], 1)
+        end
+    end
+    result[#result + 1] = seen and 0 or 1
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return result
+"""
+
+
+def bloom_parameters(expected_items, false_positive_rate, filters=1):
+    """
+    Bitmap size m and hash count k for Bloom filters holding `expected_items`
+    each, such that an item checked against all `filters` of them is a false
+    positive with probability `false_positive_rate`.
+    """
+    # 1 - (1 - p) ** (1 / filters), without losing precision for small p
+    per_filter_rate = -math.expm1(math.log1p(-false_positive_rate) / filters)
+    m = math.ceil(-expected_items * math.log(per_filter_rate) / math.log(2) ** 2)
+    k = max(1, round(m / expected_items * math.log(2)))
+    return m, k
+
+
+def bloom_offsets(item, m, k):
+    digest = hashlib.sha256(item.encode("utf-8")).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:16], "big") | 1
+    return [(h1 + i * h2) % m for i in range(k)]
+
+
+class MessageDeduplicator:
+    """
+    Decides which webhook message IDs are new, atomically across replicas.
+
+    Modes:
+        keys    - one SET NX EX key per message ID (exact, largest footprint)
+        buckets - message IDs in one Redis set per time bucket (exact, compact)
+        bloom   - one Bloom filter bitmap per time bucket (tiny, with a
+                  configurable false positive rate across all buckets, i.e.
+                  rare new messages treated as duplicates)
+
+    Every mode checks a whole batch in one round trip, and an in-process LRU
+    answers hot retries without touching Redis at all.
+    """
+
+    def __init__(self):
+        self.mode = "keys"
+        self.ttl = 43200
+        self.bucket_seconds = 3600
+        self.bloom_size, self.bloom_hashes = bloom_parameters(100000, 0.001, self._bucket_count())
+        self.local_cache = LRUCache(10000, ttl=self.ttl)
+        self.stats = {"local_hits": 0, "redis_hits": 0, "new": 0}
+        self._stats_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.mode = app.config["DEDUP_MODE"]
+        self.ttl = app.config["DEDUP_TTL"]
+        self.bucket_seconds = app.config["DEDUP_BUCKET_SECONDS"]
+        self.bloom_size, self.bloom_hashes = bloom_parameters(
+            app.config["DEDUP_EXPECTED_MESSAGES"], app.config["DEDUP_FALSE_POSITIVE_RATE"], self._bucket_count()
+        )
+        self.local_cache = LRUCache(app.config["DEDUP_LOCAL_CACHE_SIZE"], ttl=self.ttl)
+
+    def _bucket_count(self):
+        # Enough buckets to cover the whole TTL window, every ID is checked against all of them
+        return math.ceil(self.ttl / self.bucket_seconds) + 1
+
+    def _bucket_keys(self, prefix):
+        # Newest first
+        current = int(time.time() // self.bucket_seconds)
+        return [f"{prefix}:{bucket}" for bucket in range(current, current - self._bucket_count(), -1)]
+
+    def _check_redis(self, message_ids):
+        if self.mode == "buckets":
+            keys = self._bucket_keys("dedup:set")
+            script = get_redis_client().register_script(BUCKETS_SCRIPT)
+            return script(keys=keys, args=[self.ttl + self.bucket_seconds, *message_ids])
+
+        if self.mode == "bloom":
+            keys = self._bucket_keys(f"dedup:bloom:{self.bloom_size}:{self.bloom_hashes}")
+            offsets = [
+                offset
+                for message_id in message_ids
+                for offset in bloom_offsets(message_id, self.bloom_size, self.bloom_hashes)
+            ]
+            script = get_redis_client().register_script(BLOOM_SCRIPT)
+            return script(keys=keys, args=[self.ttl + self.bucket_seconds, self.bloom_hashes, *offsets])
+
+        pipeline = get_redis_client().pipeline(transaction=False)
+        for message_id in message_ids:
+            pipeline.set(message_id, "1", nx=True, ex=self.ttl)
+        return pipeline.execute()
+
+    def _count(self, stat, amount):
+        if amount:
+            with self._stats_lock:
+                self.stats[stat] += amount
+            DEDUP_RESULTS.inc(amount, result=stat)
+
+    def filter_new(self, message_ids):
+        """
+        Return a list of booleans, True where the message ID was not seen before.
+        """
+        is_new = [None] * len(message_ids)
+        unknown = []
+        for index, message_id in enumerate(message_ids):
+            if self.local_cache.get(message_id) is not None:
+                is_new[index] = False
+            else:
+                unknown.append(index)
+        self._count("local_hits", len(message_ids) - len(unknown))
+
+        if unknown:
+            results = self._check_redis([message_ids[index] for index in unknown])
+            for index, new in zip(unknown, results):
+                is_new[index] = bool(new)
+                self.local_cache.set(message_ids[index], True)
+            new_count = sum(1 for index in unknown if is_new[index])
+            self._count("new", new_count)
+            self._count("redis_hits", len(unknown) - new_count)
+
+        return is_new
+
+
+deduplicator = MessageDeduplicator()
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+
+from .lru_cache import LRUCache
+from .metrics import metrics
+from .redis_utils import get_redis_client
+
+
+GENERATION_CONFIG = {
+    "temperature": 0.9,
+    "top_p": 1,
+    "top_k": 1,
+    "max_output_tokens": 2048,
+}
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"},
+]
+
+# Stored history entries are compact [role, text] pairs, roles shortened to one letter
+ROLES = {"u": "user", "m": "model"}
+
+# Appends one user/model turn (ARGV[3], ARGV[4]) and trims the list from the
+# oldest end to the newest whole turns within ARGV[1] tokens, estimated like
+# estimate_tokens. ARGV[2] is the TTL. Concurrent turns are both kept.
+SAVE_TURN_SCRIPT = """
+redis.call('RPUSH', KEYS[1], ARGV[3], ARGV[4])
+local budget = tonumber(ARGV[1])
+local entries = redis.call('LRANGE', KEYS[1], 0, -1)
+local used = 0
+local keep = 0
+for i = #entries, 1, -1 do
+    local text = cjson.decode(entries[i])[2]
+    -- Characters, not bytes: count everything but UTF-8 continuation bytes
+    local _, characters = string.gsub(text, '[^\\128-\\191]', '')
+    used = used + math.floor(characters / 4) + 1
+    if used > budget then
+        break
+    end
+    keep = keep + 1
+end
+if keep % 2 == 1 then
+    keep = keep - 1
+end
+if keep == 0 then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+redis.call('LTRIM', KEYS[1], -keep, -1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return keep
+"""
+
+_model = None
+_model_lock = threading.Lock()
+
+# First tier of the reply cache, the second one lives in Redis
+response_cache = LRUCache()
+response_cache_stats = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+CACHE_RESULTS = metrics.counter(
+    "whatsapp_gemini_cache_total", "/ai reply cache lookups by result (local_hits, redis_hits, misses)."
+)
+
+
+def init_gemini(app):
+    """
+    Size the reply cache. The model itself is built by `warm_up_gemini` or on first use.
+    """
+    response_cache.maxsize = app.config["GEMINI_CACHE_SIZE"]
+    response_cache.ttl = app.config["GEMINI_CACHE_TTL"]
+
+
+def warm_up_gemini(app):
+    if not app.config["GEMINI_API_KEY"]:
+        logging.info("GEMINI_API_KEY not set, skipping Gemini warm-up")
+        return
+    get_model(app.config["GEMINI_API_KEY"], app.config["GEMINI_MODEL"], app.config["GEMINI_API_ENDPOINT"])
+
+
+def get_model(api_key, model_name, api_endpoint=None):
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                # The SDK takes most of the app's import time, only load it when a model is built
+                import google.generativeai as genai
+
+                if api_endpoint:
+                    # A non-default endpoint (e.g. a local stand-in) is spoken to over REST
+                    genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": api_endpoint})
+                else:
+                    genai.configure(api_key=api_key)
+                _model = genai.GenerativeModel(
+                    model_name=model_name,
+                    generation_config=GENERATION_CONFIG,
+                    safety_settings=SAFETY_SETTINGS,
+                )
+    return _model
+
+
+def estimate_tokens(text):
+    # Roughly 4 characters per token for English text, good enough for budgeting
+    return len(text) // 4 + 1
+
+
+def _history_key(wa_id):
+    return f"gemini:history:{wa_id}"
+
+
+def trim_history(entries, token_budget):
+    """
+    Keep the newest user/model turns that fit in `token_budget`.
+
+    `entries` is a list of [role, text] pairs, oldest first.
+    """
+    used = 0
+    keep = 0
+    for role, text in reversed(entries):
+        used += estimate_tokens(text)
+        if used > token_budget:
+            break
+        keep += 1
+
+    # Never start the history with a model turn
+    if keep % 2:
+        keep -= 1
+    return entries[len(entries) - keep:] if keep else []
+
+
+def load_history(wa_id, token_budget):
+    """
+    Return the stored conversation for `wa_id` as [role, text] pairs, trimmed to budget.
+    """
+    entries = [json.loads(item) for item in get_redis_client().lrange(_history_key(wa_id), 0, -1)]
+    return trim_history(entries, token_budget)
+
+
+def to_chat_history(entries):
+    return [{"role": ROLES[role], "parts": [text]} for role, text in entries]
+
+
+def save_turn(wa_id, prompt, reply, token_budget, ttl):
+    """
+    Append a user/model turn to the stored conversation and trim it to budget.
+
+    Runs as one script on Redis, so two turns saved at the same time are both kept.
+    """
+    get_redis_client().register_script(SAVE_TURN_SCRIPT)(
+        keys=[_history_key(wa_id)],
+        args=[
+            token_budget,
+            ttl,
+            json.dumps(["u", prompt], separators=(",", ":")),
+            json.dumps(["m", reply], separators=(",", ":")),
+        ],
+    )
+
+
+def clear_history(wa_id):
+    get_redis_client().delete(_history_key(wa_id))
+
+
+def normalize_prompt(prompt):
+    """
+    Fold case, whitespace and trailing punctuation so "What is Redis?" and
+    "what is  redis" share a cache entry.
+    """
+    return re.sub(r"\s+", " ", prompt.casefold()).strip().rstrip("?!. ")
+
+
+# Words that point back into a conversation, a prompt using them isn't self-contained
+CONTEXT_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "he", "him", "his",
+    "she", "her", "above", "previous", "earlier", "again", "more", "also", "else", "same", "continue",
+}
+STANDALONE_MIN_WORDS = 2
+
+
+def is_standalone_question(prompt):
+    """
+    Whether `prompt` can be answered the same way without any conversation,
+    e.g. "what is redis?" but not "why?" or "explain that again".
+    """
+    words = re.findall(r"\w+", prompt.casefold())
+    return len(words) >= STANDALONE_MIN_WORDS and not CONTEXT_WORDS.intersection(words)
+
+
+def response_cache_key(model_name, prompt):
+    key_data = json.dumps(
+        {
+            "model": model_name,
+            "config": GENERATION_CONFIG,
+            "safety": SAFETY_SETTINGS,
+            "prompt": normalize_prompt(prompt),
+        },
+        sort_keys=True,
+    )
+    return "gemini:cache:" + hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+def _count(stat):
+    with _stats_lock:
+        response_cache_stats[stat] += 1
+    CACHE_RESULTS.inc(result=stat)
+
+
+def get_cached_reply(key):
+    reply = response_cache.get(key)
+    if reply is not None:
+        _count("local_hits")
+        return reply
+
+    reply = get_redis_client().get(key)
+    if reply is not None:
+        reply = reply.decode("utf-8")
+        response_cache.set(key, reply)
+        _count("redis_hits")
+        return reply
+
+    _count("misses")
+    return None
+
+
+def set_cached_reply(key, reply, ttl):
+    response_cache.set(key, reply)
+    get_redis_client().setex(key, ttl, reply)
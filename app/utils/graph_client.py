@@ -0,0 +1,200 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+from .async_runtime import runtime
+from .rate_limiter import RedisRateLimiter, backoff_delay, parse_retry_after
+from .redis_utils import get_async_redis_client
+from .resilience import ServiceUnavailable, external_services
+
+
+def _upstream_failed(result):
+    # 4xx (including 429) means Graph is up and answering, only outages trip the breaker
+    status = result[0]
+    return status is None or status >= 500
+
+
+class GraphClient:
+    """
+    Shared WhatsApp Cloud API client.
+
+    Keeps a single aiohttp session (and its keep-alive connection pool) on the
+    runtime loop, so messages reuse open TLS connections instead of connecting
+    for every send. Settings are copied from the app config by `init_app`, which
+    lets threads without an app context send messages too.
+    """
+
+    def __init__(self):
+        self.api_base_url = "https://graph.facebook.com"
+        self.access_token = None
+        self.version = None
+        self.phone_number_id = None
+        self.pool_size = 100
+        self.max_retries = 3
+        self.retry_base_delay = 0.5
+        self.retry_max_delay = 30
+        self.rate_limiter = None
+        self.service = external_services.get("graph")
+        self._session = None
+        # The session belongs to the parent's event loop, never reuse it after fork()
+        os.register_at_fork(after_in_child=self._reset_session)
+
+    def _reset_session(self):
+        self._session = None
+
+    def init_app(self, app):
+        self.api_base_url = app.config["GRAPH_API_BASE_URL"]
+        self.access_token = app.config["ACCESS_TOKEN"]
+        self.version = app.config["VERSION"]
+        self.phone_number_id = app.config["PHONE_NUMBER_ID"]
+        self.pool_size = app.config["GRAPH_POOL_SIZE"]
+        self.max_retries = app.config["GRAPH_MAX_RETRIES"]
+        self.retry_base_delay = app.config["GRAPH_RETRY_BASE_DELAY"]
+        self.retry_max_delay = app.config["GRAPH_RETRY_MAX_DELAY"]
+        if app.config["GRAPH_RATE_LIMIT"] > 0:
+            # One budget per sending phone number, shared by every process
+            self.rate_limiter = RedisRateLimiter(
+                get_async_redis_client,
+                f"ratelimit:graph:{self.phone_number_id}",
+                app.config["GRAPH_RATE_LIMIT"],
+                app.config["GRAPH_RATE_BURST"],
+            )
+
+    @property
+    def base_url(self):
+        return f"{self.api_base_url}/{self.version}/{self.phone_number_id}"
+
+    def _get_session(self):
+        # Must be called from the runtime loop, the session is bound to it
+        if self._session is None or self._session.closed:
+            # Imported here, aiohttp is a large share of the app's import time
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=75),
+                headers={"Authorization": f"Bearer {self.access_token}"},
+            )
+        return self._session
+
+    async def open(self):
+        """
+        Open the session ahead of the first send.
+        """
+        self._get_session()
+
+    async def _post_once(self, path, **kwargs):
+        import aiohttp
+
+        session = self._get_session()
+        try:
+            async with session.post(f"{self.base_url}/{path}", **kwargs) as response:
+                body = await response.text()
+                return response.status, body, parse_retry_after(response.headers.get("Retry-After"))
+        except aiohttp.ClientConnectionError as e:
+            logging.error(f"Graph API connection error: {e}")
+            return None, None, None
+
+    async def request(self, path, **kwargs):
+        """
+        POST to `{base_url}/{path}` through the shared rate limiter.
+
+        429s, 5xx and connection errors are retried up to `max_retries` times
+        with jittered exponential backoff, waiting at least as long as the
+        Retry-After header asks. A Retry-After longer than `retry_max_delay`
+        is not waited for, the response is returned as is. Each attempt is bounded by the "graph"
+        external service timeout; while its breaker is open nothing is sent.
+        Returns (status, body_text), (None, None) if no attempt succeeded.
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire()
+
+            try:
+                status, body, retry_after = await self.service.call(
+                    self._post_once, path, failed=_upstream_failed, **kwargs
+                )
+            except ServiceUnavailable as e:
+                # Breaker open or too many sends in flight, retrying now would only add to it
+                logging.error(f"Graph API {path} not sent: {e}")
+                return None, None
+            except asyncio.TimeoutError:
+                logging.error(f"Graph API {path} timed out after {self.service.timeout}s")
+                status, body, retry_after = None, None, None
+
+            retryable = status is None or status == 429 or status >= 500
+            if not retryable or attempt == self.max_retries:
+                break
+
+            if retry_after is not None and retry_after > self.retry_max_delay:
+                # Waiting that long would hold every sender (and any thread waiting on
+                # this send), give up and let the caller retry or requeue instead
+                logging.warning(f"Graph API {path} asked to retry after {retry_after:.0f}s, not waiting")
+                if status == 429 and self.rate_limiter is not None:
+                    await self.rate_limiter.block_for(self.retry_max_delay)
+                break
+
+            delay = max(backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay), retry_after or 0)
+            if status == 429 and self.rate_limiter is not None:
+                await self.rate_limiter.block_for(delay)
+            logging.warning(f"Graph API {path} returned {status}, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        if status == 200:
+            logging.info(f"Graph API {path}: {body}")
+        else:
+            logging.error(f"Graph API {path} failed with status {status}: {body}")
+        return status, body
+
+    async def post(self, path, data):
+        """
+        POST a JSON payload (dict or already serialized str) to `{base_url}/{path}`.
+        """
+        if not isinstance(data, str):
+            data = json.dumps(data)
+        return await self.request(path, data=data, headers={"Content-type": "application/json"})
+
+    async def send(self, data):
+        return await self.post("messages", data)
+
+    async def upload_media(self, content, mime_type, filename):
+        """
+        Upload in-memory media to `{base_url}/media`, returns its media ID or None.
+
+        The multipart body is built once as bytes, so retries can resend it as is.
+        """
+        boundary = uuid.uuid4().hex
+        body = b"".join(
+            [
+                f"--{boundary}\r\n".encode(),
+                b'Content-Disposition: form-data; name="messaging_product"\r\n\r\nwhatsapp\r\n',
+                f"--{boundary}\r\n".encode(),
+                f'Content-Disposition: form-data; name="type"\r\n\r\n{mime_type}\r\n'.encode(),
+                f"--{boundary}\r\n".encode(),
+                f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'.encode(),
+                f"Content-Type: {mime_type}\r\n\r\n".encode(),
+                content,
+                f"\r\n--{boundary}--\r\n".encode(),
+            ]
+        )
+        status, response_body = await self.request(
+            "media", data=body, headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        )
+        if status != 200:
+            return None
+        return json.loads(response_body)["id"]
+
+    def send_sync(self, data, timeout=None):
+        """
+        Submit-and-wait wrapper around `send` for synchronous callers.
+        """
+        return runtime.run(self.send(data), timeout)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+graph_client = GraphClient()
@@ -0,0 +1,27 @@
+import os
+
+_session = None
+
+
+def get_http_session():
+    """
+    Shared aiohttp session for third-party APIs (Stability, Unsplash, ...).
+
+    Must be called from the asyncio runtime loop, the session is bound to it.
+    Kept apart from the Graph API session so its auth header never leaks to
+    other hosts.
+    """
+    global _session
+    if _session is None or _session.closed:
+        import aiohttp
+
+        _session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=75))
+    return _session
+
+
+def _reset_after_fork():
+    global _session
+    _session = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
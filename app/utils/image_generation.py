@@ -0,0 +1,64 @@
+import hashlib
+import json
+import logging
+
+from .http_session import get_http_session
+from .redis_utils import get_async_redis_client
+from .resilience import external_services
+
+STABILITY_API_BASE_URL = "https://api.stability.ai"
+STABILITY_ENGINE = "stable-diffusion-v1-6"
+STABILITY_PARAMS = {
+    "cfg_scale": 7,
+    "height": 1024,
+    "width": 1024,
+    "samples": 1,
+    "steps": 30,
+}
+
+
+def generated_image_key(prompt, engine=STABILITY_ENGINE, params=STABILITY_PARAMS):
+    normalized = " ".join(prompt.split()).casefold()
+    payload = json.dumps({"prompt": normalized, "engine": engine, "params": params}, sort_keys=True)
+    return f"gen:media:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+async def _request_image(prompt, api_key, engine, params, base_url):
+    async with get_http_session().post(
+        f"{base_url}/v1/generation/{engine}/text-to-image",
+        headers={
+            "Content-Type": "application/json",
+            "Accept": "image/png",
+            "Authorization": f"Bearer {api_key}",
+        },
+        json={"text_prompts": [{"text": prompt}], **params},
+    ) as response:
+        if response.status != 200:
+            return response.status, await response.text()
+        return response.status, await response.read()
+
+
+async def text_to_image(
+    prompt, api_key, engine=STABILITY_ENGINE, params=STABILITY_PARAMS, base_url=STABILITY_API_BASE_URL
+):
+    """
+    Generate one image with Stability AI and return the raw PNG bytes, or None.
+
+    Asking for image/png instead of JSON skips the base64 round trip entirely.
+    """
+    status, content = await external_services.get("stability").call(
+        _request_image, prompt, api_key, engine, params, base_url, failed=lambda result: result[0] >= 500
+    )
+    if status != 200:
+        logging.error(f"Stability AI returned {status}: {content}")
+        return None
+    return content
+
+
+async def get_cached_media_id(prompt):
+    media_id = await get_async_redis_client().get(generated_image_key(prompt))
+    return media_id.decode("utf-8") if media_id else None
+
+
+async def set_cached_media_id(prompt, media_id, ttl):
+    await get_async_redis_client().set(generated_image_key(prompt), media_id, ex=ttl)
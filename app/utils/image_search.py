@@ -0,0 +1,102 @@
+import hashlib
+import json
+import logging
+
+from .http_session import get_http_session
+from .redis_utils import get_async_redis_client
+from .resilience import external_services
+
+UNSPLASH_API_BASE_URL = "https://api.unsplash.com"
+# Last X-Ratelimit-Remaining seen, expires when Unsplash's hourly window does
+RATE_LIMIT_KEY = "unsplash:ratelimit:remaining"
+RATE_LIMIT_WINDOW = 3600
+
+
+class ImageSearchUnavailable(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Unsplash quota nearly used up, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def normalize_query(query):
+    return " ".join(query.split()).casefold()
+
+
+def _query_keys(query):
+    digest = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+    return f"unsplash:results:{digest}", f"unsplash:cursor:{digest}"
+
+
+async def _record_rate_limit(headers):
+    remaining = headers.get("X-Ratelimit-Remaining")
+    if remaining is None:
+        return
+    redis_client = get_async_redis_client()
+    # Keep the expiry of the current window, only start one when there is none
+    if not await redis_client.set(RATE_LIMIT_KEY, remaining, xx=True, keepttl=True):
+        await redis_client.set(RATE_LIMIT_KEY, remaining, ex=RATE_LIMIT_WINDOW)
+
+
+async def _check_quota(reserve):
+    redis_client = get_async_redis_client()
+    remaining = await redis_client.get(RATE_LIMIT_KEY)
+    if remaining is not None and int(remaining) <= reserve:
+        raise ImageSearchUnavailable(max(await redis_client.ttl(RATE_LIMIT_KEY), 1))
+
+
+async def _search(query, api_key, page_size, base_url):
+    async with get_http_session().get(
+        f"{base_url}/search/photos",
+        params={"query": normalize_query(query), "per_page": page_size},
+        headers={"Authorization": f"Client-ID {api_key}", "Accept-Version": "v1"},
+    ) as response:
+        if response.status != 200:
+            return response.status, response.headers, await response.text()
+        return response.status, response.headers, await response.json()
+
+
+async def fetch_results(query, api_key, page_size, base_url=UNSPLASH_API_BASE_URL):
+    """
+    One page of photo URLs for `query` from Unsplash.
+    """
+    status, headers, data = await external_services.get("unsplash").call(
+        _search, query, api_key, page_size, base_url, failed=lambda result: result[0] >= 500
+    )
+    await _record_rate_limit(headers)
+    if status in (403, 429):
+        logging.warning(f"Unsplash rate limit hit: {data}")
+        await get_async_redis_client().set(RATE_LIMIT_KEY, 0, ex=RATE_LIMIT_WINDOW)
+        raise ImageSearchUnavailable(RATE_LIMIT_WINDOW)
+    if status != 200:
+        raise RuntimeError(f"Unsplash search returned {status}: {data}")
+    return [photo["urls"]["regular"] + ".jpg" for photo in data["results"]]
+
+
+async def next_image_url(query, api_key, page_size, ttl, reserve, base_url=UNSPLASH_API_BASE_URL):
+    """
+    Next photo URL for `query`, rotating through a cached page of results.
+
+    Only the first search for a query in `ttl` seconds calls Unsplash, and
+    only while more than `reserve` requests are left in the hourly quota,
+    otherwise ImageSearchUnavailable is raised. Returns None when there are no
+    results.
+    """
+    results_key, cursor_key = _query_keys(query)
+
+    pipeline = get_async_redis_client().pipeline(transaction=False)
+    pipeline.get(results_key)
+    pipeline.incr(cursor_key)
+    pipeline.expire(cursor_key, ttl)
+    cached, position, _ = await pipeline.execute()
+
+    if cached is not None:
+        results = json.loads(cached)
+    else:
+        await _check_quota(reserve)
+        results = await fetch_results(query, api_key, page_size, base_url)
+        # Empty pages are cached too, so a query with no matches doesn't spend quota again
+        await get_async_redis_client().set(results_key, json.dumps(results), ex=ttl)
+
+    if not results:
+        return None
+    return results[(position - 1) % len(results)]
@@ -0,0 +1,90 @@
+import atexit
+import functools
+import logging
+import os
+import socket
+import uuid
+
+from .redis_utils import get_redis_client
+
+
+# Take the lock if it is free, or extend it if this process already holds it
+ACQUIRE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderLock:
+    """
+    Elects one process, across web and worker processes, to run singleton jobs.
+
+    Every process refreshes a Redis key holding its own token every `ttl / 3`
+    seconds. Whoever holds the key is the leader; if it dies another process
+    takes over within `ttl` seconds. Wrap jobs that must not run in parallel
+    with `only`.
+    """
+
+    def __init__(self, key="leader:background", ttl=30):
+        self.key = key
+        self.ttl = ttl
+        self.token = None
+        self.is_leader = False
+
+    def init_app(self, app, scheduler):
+        self.key = app.config["LEADER_LOCK_KEY"]
+        self.ttl = app.config["LEADER_LOCK_TTL"]
+        # Created here rather than in __init__ so every forked worker gets its own
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        scheduler.every(self.ttl / 3, self.refresh, name="leader_refresh", start_after=0)
+        atexit.register(self.release)
+
+    def refresh(self):
+        try:
+            script = get_redis_client().register_script(ACQUIRE_SCRIPT)
+            is_leader = bool(script(keys=[self.key], args=[self.token, int(self.ttl * 1000)]))
+        except Exception:
+            logging.exception("Failed to refresh leader lock")
+            is_leader = False
+
+        if is_leader != self.is_leader:
+            logging.info(f"{'Acquired' if is_leader else 'Lost'} leader lock '{self.key}'")
+        self.is_leader = is_leader
+        return is_leader
+
+    def release(self):
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        try:
+            get_redis_client().register_script(RELEASE_SCRIPT)(keys=[self.key], args=[self.token])
+        except Exception:
+            logging.exception("Failed to release leader lock")
+
+    def only(self, fn):
+        """
+        Wrap `fn` so it silently does nothing outside the leader process.
+        """
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if self.is_leader:
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+
+leader = LeaderLock()
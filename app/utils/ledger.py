@@ -0,0 +1,193 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+
+from .redis_utils import get_redis_client
+from .resilience import external_services
+from .sheets import get_sheets_service
+
+BALANCE_KEY = "money:balance"
+# Append-only history of every change, and the part of it not yet written to Sheets
+LOG_KEY = "money:log"
+PENDING_KEY = "money:pending"
+# Balance after the last entry appended to Sheets, until it is written to the balance cell
+SHEET_BALANCE_KEY = "money:sheet_balance"
+
+# Refuses to run before the balance is seeded, so a Redis reset never restarts from 0
+RECORD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+local balance = redis.call('INCRBY', KEYS[1], ARGV[1])
+local entry = cjson.encode({
+    ts = tonumber(ARGV[2]),
+    wa_id = ARGV[3],
+    action = ARGV[4],
+    amount = tonumber(ARGV[5]),
+    note = ARGV[6],
+    delta = tonumber(ARGV[1]),
+    balance = balance,
+})
+redis.call('RPUSH', KEYS[2], entry)
+redis.call('RPUSH', KEYS[3], entry)
+return balance
+"""
+
+# Another flush may have queued a newer balance while this one was being written
+CLEAR_SHEET_BALANCE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class MoneyLedger:
+    """
+    Shared balance kept in Redis, with Google Sheets as the write-behind copy.
+
+    Every change is one atomic INCRBY plus an entry in an append-only log, so
+    concurrent /money messages never lose an update and /balance is a single
+    GET. `flush` writes pending entries to Sheets in one append and then the
+    balance cell in one batchUpdate; entries stay pending until their append
+    succeeds, so a Sheets outage only delays the copy.
+    """
+
+    def __init__(self):
+        self.sheet_id = None
+        self.balance_range = "A1:A1"
+        self.log_range = "Log!A:F"
+        self.flush_batch = 500
+        self._seed_lock = threading.Lock()
+
+    def init_app(self, app, scheduler, leader):
+        self.sheet_id = app.config["MONEY_SHEET_ID"]
+        self.balance_range = app.config["MONEY_BALANCE_RANGE"]
+        self.log_range = app.config["MONEY_LOG_RANGE"]
+        self.flush_batch = app.config["MONEY_FLUSH_BATCH"]
+        # Flushing from several processes at once would append the same entries twice
+        scheduler.every(app.config["MONEY_FLUSH_INTERVAL"], leader.only(self.flush), name="money_flush")
+
+    def _seed(self):
+        """
+        Copy the balance from Sheets into Redis if Redis doesn't have it yet.
+        """
+        with self._seed_lock:
+            if get_redis_client().exists(BALANCE_KEY):
+                return True
+            try:
+                request = (
+                    get_sheets_service()
+                    .spreadsheets()
+                    .values()
+                    .get(spreadsheetId=self.sheet_id, range=self.balance_range)
+                )
+                result = external_services.get("sheets").call_sync(request.execute)
+            except Exception:
+                logging.exception("Failed to read the money balance from Google Sheets")
+                return False
+
+            values = result.get("values", [])
+            balance = int(values[0][0]) if values and values[0] else 0
+            get_redis_client().set(BALANCE_KEY, balance, nx=True)
+            logging.info(f"Seeded money balance {balance} from Google Sheets")
+            return True
+
+    def get_balance(self):
+        """
+        Current balance, or None if it isn't in Redis and Sheets can't be read.
+        """
+        balance = get_redis_client().get(BALANCE_KEY)
+        if balance is None:
+            if not self._seed():
+                return None
+            balance = get_redis_client().get(BALANCE_KEY)
+        return int(balance)
+
+    def record(self, wa_id, action, amount, delta, note):
+        """
+        Apply `delta` to the balance and log it. Returns the new balance, or
+        None if the balance could not be seeded.
+        """
+        args = [delta, int(time.time()), wa_id, action, amount, note]
+        keys = [BALANCE_KEY, LOG_KEY, PENDING_KEY]
+
+        balance = get_redis_client().register_script(RECORD_SCRIPT)(keys=keys, args=args)
+        if balance is None:
+            if not self._seed():
+                return None
+            balance = get_redis_client().register_script(RECORD_SCRIPT)(keys=keys, args=args)
+        return balance
+
+    def flush(self):
+        """
+        Write pending log entries, then the balance they end on, to Google Sheets.
+        """
+        flushed = self._flush_entries()
+        self._flush_balance()
+        return flushed
+
+    def _flush_entries(self):
+        redis_client = get_redis_client()
+        entries = [json.loads(entry) for entry in redis_client.lrange(PENDING_KEY, 0, self.flush_batch - 1)]
+        if not entries:
+            return 0
+
+        rows = [
+            [
+                datetime.fromtimestamp(entry["ts"]).strftime("%Y-%m-%d %H:%M:%S"),
+                entry["wa_id"],
+                entry["action"],
+                entry["amount"],
+                entry["note"],
+                entry["balance"],
+            ]
+            for entry in entries
+        ]
+        values = get_sheets_service().spreadsheets().values()
+        external_services.get("sheets").call_sync(
+            values.append(
+                spreadsheetId=self.sheet_id,
+                range=self.log_range,
+                valueInputOption="RAW",
+                insertDataOption="INSERT_ROWS",
+                body={"values": rows},
+            ).execute
+        )
+
+        # Drop the rows right away so a failure below can't append them twice. Only
+        # what was written goes, entries recorded meanwhile stay for the next flush.
+        # The balance cell gets the balance after the last row appended, never one
+        # from entries still pending.
+        pipeline = redis_client.pipeline()
+        pipeline.ltrim(PENDING_KEY, len(entries), -1)
+        pipeline.set(SHEET_BALANCE_KEY, entries[-1]["balance"])
+        pipeline.execute()
+        logging.info(f"Flushed {len(entries)} money log entries to Google Sheets")
+        return len(entries)
+
+    def _flush_balance(self):
+        """
+        Write the balance queued by `_flush_entries` to the balance cell. Writing
+        it twice is harmless, so a failure just leaves it for the next flush.
+        """
+        redis_client = get_redis_client()
+        balance = redis_client.get(SHEET_BALANCE_KEY)
+        if balance is None:
+            return
+        values = get_sheets_service().spreadsheets().values()
+        external_services.get("sheets").call_sync(
+            values.batchUpdate(
+                spreadsheetId=self.sheet_id,
+                body={
+                    "valueInputOption": "RAW",
+                    "data": [{"range": self.balance_range, "majorDimension": "ROWS", "values": [[int(balance)]]}],
+                },
+            ).execute
+        )
+        redis_client.register_script(CLEAR_SHEET_BALANCE_SCRIPT)(keys=[SHEET_BALANCE_KEY], args=[balance])
+
+
+money_ledger = MoneyLedger()
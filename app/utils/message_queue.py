@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import current_app
+
+from .metrics import metrics
+from .profiling import profiler
+from .redis_utils import get_redis_client
+from .whatsapp_utils import get_message_events, process_message_event, router
+
+_dispatch_executor = None
+_dispatch_executor_lock = threading.Lock()
+
+metrics.gauge(
+    "whatsapp_webhook_queue_length",
+    "Message groups waiting for worker.py (queue processing mode).",
+    lambda: get_redis_client().llen(current_app.config["WEBHOOK_QUEUE_KEY"]),
+)
+
+
+def group_by_sender(events):
+    """
+    Group events per wa_id so one user's messages keep their order while
+    different users are handled in parallel.
+    """
+    groups = {}
+    for event in events:
+        groups.setdefault(event["wa_id"], []).append(event)
+    return list(groups.values())
+
+
+def tag_profile(events):
+    """
+    Record the commands and senders of `events` on the current thread's profile.
+    """
+    for event in events:
+        message = event["message"]
+        command = router.resolve(message["text"]["body"]) if message.get("type", "text") == "text" else None
+        profiler.tag(command=command.name if command else "none", wa_id=event["wa_id"])
+
+
+def process_event_group(app, events, profile=None, source="dispatch"):
+    """
+    Process one sender's events in order. `profile` ("sampled" or "forced")
+    records a profile of this group, unless the thread is already profiled
+    (a single group run inline on the request thread).
+    """
+    group_profile = None
+    if profile is not None and profiler.current() is None:
+        group_profile = profiler.start(forced=profile == "forced")
+        tag_profile(events)
+    try:
+        with app.app_context():
+            for event in events:
+                try:
+                    process_message_event(event)
+                except Exception:
+                    logging.exception(f"Failed to process message {event['message'].get('id')}")
+    finally:
+        if group_profile is not None:
+            profiler.stop(group_profile, source, 200)
+
+
+def _get_dispatch_executor(app):
+    global _dispatch_executor
+    if _dispatch_executor is None:
+        with _dispatch_executor_lock:
+            if _dispatch_executor is None:
+                _dispatch_executor = ThreadPoolExecutor(
+                    max_workers=app.config["WORKER_CONCURRENCY"], thread_name_prefix="dispatch"
+                )
+    return _dispatch_executor
+
+
+def dispatch_events(events):
+    """
+    Process message events inside the current request, concurrently per sender.
+    """
+    app = current_app._get_current_object()
+    groups = group_by_sender(events)
+
+    if len(groups) == 1:
+        process_event_group(app, groups[0])
+        return
+
+    # A profiled request gets one more profile per sender, run on the dispatch threads
+    request_profile = profiler.current()
+    profile = None if request_profile is None else "forced" if request_profile.forced else "sampled"
+    executor = _get_dispatch_executor(app)
+    wait([executor.submit(process_event_group, app, group, profile) for group in groups])
+
+
+def enqueue_events(events):
+    """
+    Push already validated and deduplicated message events onto the worker queue,
+    one queue item per sender.
+    """
+    request_profile = profiler.current()
+    if request_profile is not None and request_profile.forced:
+        # A forced profile follows the messages to the worker
+        events = [{**event, "profile": "forced"} for event in events]
+    items = [json.dumps(group) for group in group_by_sender(events)]
+    get_redis_client().lpush(current_app.config["WEBHOOK_QUEUE_KEY"], *items)
+
+
+def _processing_key(queue_key, worker_id):
+    return f"{queue_key}:processing:{worker_id}"
+
+
+def _heartbeat_key(queue_key, worker_id):
+    return f"{queue_key}:worker:{worker_id}"
+
+
+def _workers_key(queue_key):
+    return f"{queue_key}:workers"
+
+
+def requeue_abandoned(queue_key):
+    """
+    Move the items of workers whose heartbeat expired back onto the queue.
+
+    Their message IDs are already marked as seen, so Meta's retries would be
+    dropped as duplicates; requeueing is the only way they still get processed.
+    Returns the number of items requeued.
+    """
+    redis_client = get_redis_client()
+    requeued = 0
+    for worker_id in redis_client.smembers(_workers_key(queue_key)):
+        worker_id = worker_id.decode("utf-8")
+        if redis_client.exists(_heartbeat_key(queue_key, worker_id)):
+            continue
+        processing_key = _processing_key(queue_key, worker_id)
+        # Back to the consuming end, they are the oldest items
+        while redis_client.lmove(processing_key, queue_key, "RIGHT", "RIGHT") is not None:
+            requeued += 1
+        redis_client.srem(_workers_key(queue_key), worker_id)
+    if requeued:
+        logging.warning(f"Requeued {requeued} item(s) left by stopped workers on '{queue_key}'")
+    return requeued
+
+
+def _process_queued_item(app, raw_item, slots, processing_key):
+    try:
+        item = json.loads(raw_item)
+        # Items queued before batching support hold the whole webhook body
+        events = item if isinstance(item, list) else get_message_events(item)
+        forced = any(event.get("profile") == "forced" for event in events)
+        profile = "forced" if forced else profiler.should_profile(None)
+        process_event_group(app, events, profile, source="worker")
+    except Exception:
+        logging.exception("Failed to process queued webhook")
+    finally:
+        # Failed items are dropped like before, only a dead worker's items are retried
+        try:
+            get_redis_client().lrem(processing_key, 1, raw_item)
+        except Exception:
+            logging.exception("Failed to remove a processed item from the processing list")
+        slots.release()
+
+
+def run_worker(app, stop_event=None, concurrency=None):
+    """
+    Drain the webhook queue, running at most `concurrency` items at a time.
+
+    Runs until `stop_event` is set; an item is only taken once a slot is free so
+    nothing sits in local memory when the worker is stopped. Items are moved
+    with BLMOVE into this worker's own processing list and removed from it once
+    handled, while a heartbeat key marks the worker alive. Items of workers
+    whose heartbeat expired (killed mid-item) are requeued at startup and on
+    every heartbeat.
+    """
+    stop_event = stop_event or threading.Event()
+    concurrency = concurrency or app.config["WORKER_CONCURRENCY"]
+    queue_key = app.config["WEBHOOK_QUEUE_KEY"]
+    heartbeat_ttl = app.config["WORKER_HEARTBEAT_TTL"]
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    processing_key = _processing_key(queue_key, worker_id)
+    heartbeat_key = _heartbeat_key(queue_key, worker_id)
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def heartbeat():
+        redis_client = get_redis_client()
+        # Alive before registered, so no other worker takes this one for dead
+        redis_client.set(heartbeat_key, "1", ex=heartbeat_ttl)
+        redis_client.sadd(_workers_key(queue_key), worker_id)
+        requeue_abandoned(queue_key)
+
+    heartbeat()
+    next_heartbeat = time.monotonic() + heartbeat_ttl / 3
+
+    logging.info(f"Worker {worker_id} started on '{queue_key}' with concurrency {concurrency}")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while not stop_event.is_set():
+            if time.monotonic() >= next_heartbeat:
+                try:
+                    heartbeat()
+                except Exception:
+                    logging.exception("Worker heartbeat failed")
+                next_heartbeat = time.monotonic() + heartbeat_ttl / 3
+
+            if not slots.acquire(timeout=1):
+                continue
+
+            raw_item = get_redis_client().blmove(queue_key, processing_key, 1, "RIGHT", "LEFT")
+            if raw_item is None:
+                slots.release()
+                continue
+
+            executor.submit(_process_queued_item, app, raw_item, slots, processing_key)
+
+    # Every item has been handled, nothing is left to requeue
+    redis_client = get_redis_client()
+    redis_client.delete(heartbeat_key)
+    redis_client.srem(_workers_key(queue_key), worker_id)
+    logging.info("Worker stopped")
@@ -0,0 +1,248 @@
+import atexit
+import bisect
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from a Redis round trip up to a slow Stability AI generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICS_KEY = "metrics:totals"
+
+_LE_PATTERN = re.compile(r'le="([^"]+)"')
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def series_name(name, labels):
+    """
+    Prometheus text format name of one series, e.g. 'x_total{command="ai"}'.
+    """
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _series_sort_key(series):
+    # Buckets of one histogram must come out in ascending `le` order
+    match = _LE_PATTERN.search(series)
+    if match is None:
+        return series, 0.0
+    return _LE_PATTERN.sub("", series), float(match.group(1))
+
+
+class Counter:
+    def __init__(self, registry, name, help_text):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+
+    def inc(self, amount=1, **labels):
+        self.registry.add([(series_name(self.name, labels), amount)])
+
+
+class Histogram:
+    def __init__(self, registry, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        # labels -> (bucket series names including +Inf, sum series, count series)
+        self._series = {}
+
+    def _series_for(self, labels):
+        key = tuple(labels.items())
+        series = self._series.get(key)
+        if series is None:
+            buckets = [series_name(f"{self.name}_bucket", {**labels, "le": bound}) for bound in self.buckets]
+            buckets.append(series_name(f"{self.name}_bucket", {**labels, "le": "+Inf"}))
+            series = self._series[key] = (
+                buckets,
+                series_name(f"{self.name}_sum", labels),
+                series_name(f"{self.name}_count", labels),
+            )
+        return series
+
+    def observe(self, value, **labels):
+        buckets, sum_series, count_series = self._series_for(labels)
+        # Buckets are stored cumulative, like they are exposed: every bound >= value counts it
+        deltas = [(bucket, 1) for bucket in buckets[bisect.bisect_left(self.buckets, value):]]
+        deltas.append((sum_series, value))
+        deltas.append((count_series, 1))
+        self.registry.add(deltas)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class Gauge:
+    """
+    Read when /metrics is scraped. `collect` returns a number, or a list of
+    (labels, value) pairs for a labeled gauge.
+    """
+
+    def __init__(self, registry, name, help_text, collect):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+
+    def samples(self):
+        values = self.collect()
+        if not isinstance(values, list):
+            return [(self.name, values)]
+        return [(series_name(self.name, labels), value) for labels, value in values]
+
+
+class Metrics:
+    """
+    Counters and histograms for /metrics, shared by every process through Redis.
+
+    Recording only updates an in-memory dict, the deltas are added to the
+    `metrics:totals` hash with HINCRBYFLOAT by a one-shot scheduler job
+    `flush_interval` seconds after the first recording since the last flush,
+    so a scrape sees totals for all gunicorn workers whichever one answers it
+    and an idle process doesn't wake the scheduler. Gauges are read live from
+    the answering process.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.flush_interval = 10
+        self.families = {}
+        self._deltas = {}
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self._flush_scheduled = False
+        self._local = threading.local()
+
+    def init_app(self, app, scheduler):
+        self.enabled = app.config["METRICS_ENABLED"]
+        if self.enabled:
+            self.flush_interval = app.config["METRICS_FLUSH_INTERVAL"]
+            self._scheduler = scheduler
+            atexit.register(self.flush)
+
+    def _register(self, family):
+        self.families[family.name] = family
+        return family
+
+    def counter(self, name, help_text):
+        return self._register(Counter(self, name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help_text, buckets))
+
+    def gauge(self, name, help_text, collect):
+        return self._register(Gauge(self, name, help_text, collect))
+
+    def add(self, deltas):
+        if not self.enabled:
+            return
+        with self._lock:
+            for series, amount in deltas:
+                self._deltas[series] = self._deltas.get(series, 0) + amount
+            # The flush records its own Redis call, which must not schedule the
+            # next flush or an idle process would flush forever. That sample
+            # goes out with the next flush instead.
+            schedule = not self._flush_scheduled and not getattr(self._local, "flushing", False)
+            if schedule:
+                self._flush_scheduled = True
+        if schedule:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._scheduler is not None:
+            self._scheduler.at(time.time() + self.flush_interval, self.flush, name="metrics_flush")
+
+    def _take_deltas(self):
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+            self._flush_scheduled = False
+        return deltas
+
+    def flush(self):
+        """
+        Add the deltas recorded since the last flush to Redis. They are kept for
+        the next flush if Redis can't be reached.
+        """
+        # Imported here because the Redis clients are instrumented with these metrics
+        from .redis_utils import get_redis_client
+
+        deltas = self._take_deltas()
+        if not deltas:
+            return 0
+        self._local.flushing = True
+        try:
+            pipeline = get_redis_client().pipeline(transaction=False)
+            for series, amount in deltas.items():
+                pipeline.hincrbyfloat(METRICS_KEY, series, amount)
+            pipeline.execute()
+        except Exception:
+            logging.exception("Failed to flush metrics to Redis")
+            self._local.flushing = False
+            self.add(deltas.items())
+            return 0
+        finally:
+            self._local.flushing = False
+        return len(deltas)
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        from .redis_utils import get_redis_client
+
+        totals = {}
+        try:
+            for series, value in get_redis_client().hgetall(METRICS_KEY).items():
+                totals[series.decode("utf-8")] = float(value)
+        except Exception:
+            logging.exception("Failed to read metrics from Redis, showing this process only")
+        # Include what this process hasn't flushed yet, without taking it out of the buffer
+        with self._lock:
+            for series, amount in self._deltas.items():
+                totals[series] = totals.get(series, 0) + amount
+
+        by_family = {}
+        for series, value in totals.items():
+            name = series.partition("{")[0]
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[: -len(suffix)] in self.families:
+                    name = name[: -len(suffix)]
+                    break
+            by_family.setdefault(name, []).append((series, value))
+
+        lines = []
+        for name in sorted(self.families):
+            family = self.families[name]
+            if isinstance(family, Gauge):
+                try:
+                    samples = family.samples()
+                except Exception as e:
+                    logging.warning(f"Failed to collect gauge {name}: {e}")
+                    continue
+                kind = "gauge"
+            else:
+                samples = sorted(by_family.get(name, []), key=lambda sample: _series_sort_key(sample[0]))
+                kind = "counter" if isinstance(family, Counter) else "histogram"
+            lines.append(f"# HELP {name} {family.help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{series} {_format_value(value)}" for series, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
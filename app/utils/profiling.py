@@ -0,0 +1,229 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+
+def verify_admin_signature(header, secret, max_age=300):
+    """
+    Check an "t=<unix time>,sig=<hex HMAC-SHA256 of the time with `secret`>" header.
+
+    The time keeps a captured header from being replayed later than `max_age` seconds.
+    """
+    if not header or not secret:
+        return False
+    try:
+        fields = dict(part.split("=", 1) for part in header.split(","))
+        timestamp = int(fields["t"])
+        signature = fields["sig"]
+    except (KeyError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > max_age:
+        return False
+    expected = hmac.new(secret.encode("utf-8"), str(timestamp).encode("utf-8"), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def sign_admin_header(secret, timestamp=None):
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    signature = hmac.new(secret.encode("utf-8"), str(timestamp).encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"t={timestamp},sig={signature}"
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profile:
+    def __init__(self, thread_id, forced):
+        self.id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.thread_id = thread_id
+        self.forced = forced
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.commands = []
+        self.wa_id_hashes = []
+        # Collapsed stack ("outer;inner;innermost") -> samples
+        self.stacks = {}
+        self.samples = 0
+
+    def add_sample(self, frame):
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+
+class RequestProfiler:
+    """
+    Sampling profiler for webhook requests.
+
+    A request is profiled when PROFILING_ENABLED picks it (PROFILE_SAMPLE_RATE)
+    or when it carries a valid X-Admin-Signature. One background thread reads
+    the stacks of every thread being profiled each PROFILE_INTERVAL_MS, so
+    profiled requests run at full speed and the rest pay nothing. Each profile
+    is written to PROFILE_DIR as JSON with collapsed stacks, keeping the newest
+    PROFILE_MAX_FILES.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.01
+        self.interval = 0.005
+        self.directory = "profiles"
+        self.max_files = 200
+        self.secret = None
+        self._hash_key = b""
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        self.enabled = app.config["PROFILING_ENABLED"]
+        self.sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+        self.interval = app.config["PROFILE_INTERVAL_MS"] / 1000
+        self.directory = app.config["PROFILE_DIR"]
+        self.max_files = app.config["PROFILE_MAX_FILES"]
+        self.secret = app.config["PROFILING_SECRET"]
+        # wa_ids are hashed with a key, a bare hash of a phone number is easy to reverse
+        self._hash_key = (app.config["APP_SECRET"] or "").encode("utf-8")
+
+    def should_profile(self, admin_header):
+        """
+        Returns None (don't profile), "sampled" or "forced".
+        """
+        if admin_header and verify_admin_signature(admin_header, self.secret):
+            return "forced"
+        if self.enabled and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def start(self, forced=False):
+        profile = Profile(threading.get_ident(), forced)
+        with self._lock:
+            self._active[profile.thread_id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return profile
+
+    def current(self):
+        return self._active.get(threading.get_ident())
+
+    def tag(self, command=None, wa_id=None):
+        profile = self.current()
+        if profile is None:
+            return
+        if command is not None and command not in profile.commands:
+            profile.commands.append(command)
+        if wa_id is not None:
+            wa_id_hash = hmac.new(self._hash_key, str(wa_id).encode("utf-8"), hashlib.sha256).hexdigest()[:12]
+            if wa_id_hash not in profile.wa_id_hashes:
+                profile.wa_id_hashes.append(wa_id_hash)
+
+    def stop(self, profile, path, status):
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+        duration_ms = (time.perf_counter() - profile.start) * 1000
+        try:
+            self._write(profile, path, status, duration_ms)
+        except Exception:
+            # Profiling must never fail the request it profiles
+            logging.exception("Failed to write request profile")
+
+    def _run(self):
+        while True:
+            with self._lock:
+                active = list(self._active.values())
+            if not active:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            # Under the lock and only for profiles still active, so a sample never
+            # lands in one that `stop` has taken and is writing out
+            with self._lock:
+                for profile in self._active.values():
+                    frame = frames.get(profile.thread_id)
+                    if frame is not None:
+                        profile.add_sample(frame)
+            del frames
+            time.sleep(self.interval)
+
+    def _write(self, profile, path, status, duration_ms):
+        os.makedirs(self.directory, exist_ok=True)
+        data = {
+            "id": profile.id,
+            "started_at": profile.started_at,
+            "duration_ms": round(duration_ms, 2),
+            "path": path,
+            "status": status,
+            "forced": profile.forced,
+            "commands": profile.commands,
+            "wa_id_hashes": profile.wa_id_hashes,
+            "interval_ms": self.interval * 1000,
+            "samples": profile.samples,
+            "stacks": profile.stacks,
+        }
+        with open(os.path.join(self.directory, f"{profile.id}.json"), "w") as file:
+            json.dump(data, file)
+        self._rotate()
+
+    def _rotate(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        for name in names[: max(len(names) - self.max_files, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # Another worker rotated it first
+                pass
+
+    def load(self, profile_id):
+        if not profile_id.replace("-", "").isalnum():
+            return None
+        try:
+            with open(os.path.join(self.directory, f"{profile_id}.json")) as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def slowest(self, limit=20):
+        """
+        Summaries of the slowest profiles on disk, slowest first.
+        """
+        summaries = []
+        if not os.path.isdir(self.directory):
+            return summaries
+        for name in os.listdir(self.directory):
+            data = self.load(name[: -len(".json")]) if name.endswith(".json") else None
+            if data is None:
+                continue
+            data.pop("stacks")
+            summaries.append(data)
+        summaries.sort(key=lambda summary: summary["duration_ms"], reverse=True)
+        return summaries[:limit]
+
+
+def collapsed_stacks(profile):
+    """
+    The profile in collapsed stack format, for flamegraph.pl or speedscope.
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].items())
+
+
+profiler = RequestProfiler()
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import random
+
+# Token bucket shared by every process through Redis. KEYS[1] holds the bucket,
+# KEYS[2] is set while the upstream asked everyone to back off (Retry-After).
+# Returns "0" when a token was taken, otherwise the seconds to wait before retrying.
+TOKEN_BUCKET_SCRIPT = """
+local blocked_ms = redis.call('PTTL', KEYS[2])
+if blocked_ms > 0 then
+    return tostring(blocked_ms / 1000)
+end
+
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter:
+    """
+    Cluster-wide token bucket, `rate` requests per second with bursts of `burst`.
+
+    Uses an asyncio Redis client, so it must be awaited on the runtime loop. If
+    Redis is unreachable the limiter lets requests through rather than
+    dropping messages.
+    """
+
+    def __init__(self, get_redis, key, rate, burst=None):
+        self.key = key
+        self.blocked_key = f"{key}:blocked"
+        self.rate = rate
+        self.burst = burst or rate
+        self._get_redis = get_redis
+
+    async def acquire(self):
+        while True:
+            try:
+                script = self._get_redis().register_script(TOKEN_BUCKET_SCRIPT)
+                wait = float(await script(keys=[self.key, self.blocked_key], args=[self.rate, self.burst]))
+            except Exception as e:
+                logging.warning(f"Rate limiter unavailable, not throttling: {e}")
+                return
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def block_for(self, seconds):
+        """
+        Make every process wait `seconds` before the next request, e.g. after a 429.
+        """
+        try:
+            await self._get_redis().set(self.blocked_key, "1", px=max(int(seconds * 1000), 1))
+        except Exception as e:
+            logging.warning(f"Could not store rate limit backoff: {e}")
+
+
+def backoff_delay(attempt, base, cap):
+    """
+    Exponential backoff with full jitter for retry number `attempt` (starting at 0).
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def parse_retry_after(value):
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import os
+
+from .async_runtime import runtime
+from .graph_client import graph_client
+
+
+class ReadReceipts:
+    """
+    Blue ticks (and the typing indicator) sent as soon as messages are accepted.
+
+    Sending never blocks the caller, the receipts go out from the runtime loop.
+    WhatsApp marks every earlier message in a chat as read together with the
+    one named, so one receipt per sender covers a burst: the first message is
+    acknowledged right away, anything arriving in the next `window` seconds is
+    folded into a single receipt for the newest message at the end of it.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.typing_indicator = True
+        self.window = 1.0
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Only touched from the runtime loop
+        self._pending = {}  # wa_id -> newest message ID not acknowledged yet
+        self._cooling = set()  # wa_ids with a receipt sent less than `window` ago
+        self._tasks = set()
+
+    def init_app(self, app):
+        self.enabled = app.config["READ_RECEIPTS_ENABLED"]
+        self.typing_indicator = app.config["TYPING_INDICATOR_ENABLED"]
+        self.window = app.config["READ_RECEIPT_WINDOW"]
+
+    def mark_read(self, events):
+        """
+        Acknowledge message events from any thread, returns immediately.
+        """
+        if not self.enabled or not events:
+            return
+        latest = {}
+        for event in events:
+            latest[event["wa_id"]] = event["message"]["id"]
+        runtime.loop.call_soon_threadsafe(self._accept, latest)
+
+    def _accept(self, latest):
+        for wa_id, message_id in latest.items():
+            if wa_id in self._cooling:
+                self._pending[wa_id] = message_id
+            else:
+                self._send(wa_id, message_id)
+
+    def _send(self, wa_id, message_id):
+        self._cooling.add(wa_id)
+        task = asyncio.ensure_future(self._post(message_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        runtime.loop.call_later(self.window, self._end_window, wa_id)
+
+    def _end_window(self, wa_id):
+        self._cooling.discard(wa_id)
+        message_id = self._pending.pop(wa_id, None)
+        if message_id is not None:
+            self._send(wa_id, message_id)
+
+    async def _post(self, message_id):
+        data = {"messaging_product": "whatsapp", "status": "read", "message_id": message_id}
+        if self.typing_indicator:
+            # Shown until the reply is sent or for 25 seconds
+            data["typing_indicator"] = {"type": "text"}
+        try:
+            await graph_client.send(data)
+        except Exception:
+            logging.exception(f"Failed to send read receipt for {message_id}")
+
+
+read_receipts = ReadReceipts()
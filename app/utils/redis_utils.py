@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+
+import redis
+import redis.asyncio
+from dotenv import load_dotenv
+
+from .metrics import metrics
+
+
+load_dotenv()
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379")
+
+# Hosted Redis (e.g. Heroku) uses self-signed TLS certificates, plain redis:// rejects the option
+REDIS_OPTIONS = {"ssl_cert_reqs": None} if REDIS_URL.startswith("rediss://") else {}
+
+REDIS_DURATION = metrics.histogram(
+    "whatsapp_redis_duration_seconds", "Redis command and pipeline round trips, by command."
+)
+
+_redis_client = None
+_async_redis_client = None
+_lock = threading.Lock()
+
+
+def _instrument(client):
+    """
+    Time every command and pipeline `client` sends, for /metrics.
+    """
+    execute_command = client.execute_command
+    make_pipeline = client.pipeline
+
+    if isinstance(client, redis.asyncio.Redis):
+
+        async def timed_command(*args, **options):
+            start = time.perf_counter()
+            try:
+                return await execute_command(*args, **options)
+            finally:
+                REDIS_DURATION.observe(time.perf_counter() - start, command=str(args[0]).upper())
+
+        def timed_pipeline(*args, **kwargs):
+            pipeline = make_pipeline(*args, **kwargs)
+            execute = pipeline.execute
+
+            async def timed_execute(*execute_args, **execute_kwargs):
+                start = time.perf_counter()
+                try:
+                    return await execute(*execute_args, **execute_kwargs)
+                finally:
+                    REDIS_DURATION.observe(time.perf_counter() - start, command="PIPELINE")
+
+            pipeline.execute = timed_execute
+            return pipeline
+
+    else:
+
+        def timed_command(*args, **options):
+            start = time.perf_counter()
+            try:
+                return execute_command(*args, **options)
+            finally:
+                REDIS_DURATION.observe(time.perf_counter() - start, command=str(args[0]).upper())
+
+        def timed_pipeline(*args, **kwargs):
+            pipeline = make_pipeline(*args, **kwargs)
+            execute = pipeline.execute
+
+            def timed_execute(*execute_args, **execute_kwargs):
+                start = time.perf_counter()
+                try:
+                    return execute(*execute_args, **execute_kwargs)
+                finally:
+                    REDIS_DURATION.observe(time.perf_counter() - start, command="PIPELINE")
+
+            pipeline.execute = timed_execute
+            return pipeline
+
+    client.execute_command = timed_command
+    client.pipeline = timed_pipeline
+    return client
+
+
+def get_redis_client():
+    """
+    Shared Redis client, created on first use.
+    """
+    global _redis_client
+    if _redis_client is None:
+        with _lock:
+            if _redis_client is None:
+                _redis_client = _instrument(redis.from_url(REDIS_URL, **REDIS_OPTIONS))
+    return _redis_client
+
+
+def get_async_redis_client():
+    """
+    Shared asyncio Redis client, only for coroutines running on the asyncio runtime loop.
+    """
+    global _async_redis_client
+    if _async_redis_client is None:
+        with _lock:
+            if _async_redis_client is None:
+                _async_redis_client = _instrument(redis.asyncio.from_url(REDIS_URL, **REDIS_OPTIONS))
+    return _async_redis_client
+
+
+def _reset_after_fork():
+    # redis-py reconnects sync pools after fork, but the asyncio client is tied to the parent's loop
+    global _async_redis_client, _lock
+    _async_redis_client = None
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def set_redis_clients(client, async_client=None):
+    """
+    Replace the shared clients, e.g. with fakeredis in benchmarks.
+    """
+    global _redis_client, _async_redis_client
+    with _lock:
+        _redis_client = client
+        _async_redis_client = async_client
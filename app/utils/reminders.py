@@ -0,0 +1,132 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import wait
+
+from .async_runtime import runtime
+from .metrics import metrics
+from .redis_utils import get_redis_client
+
+DUE_KEY = "reminders:due"
+INFLIGHT_KEY = "reminders:inflight"
+DATA_KEY = "reminders:data"
+WAKEUP_KEY = "reminders:wakeup"
+
+metrics.gauge(
+    "whatsapp_reminders_scheduled", "Reminders waiting to be sent.", lambda: get_redis_client().zcard(DUE_KEY)
+)
+
+# Moves reminders whose lease expired (their dispatcher died mid-send) back to
+# the due set, then atomically claims up to ARGV[2] due reminders by leasing
+# them until ARGV[3]. Only one dispatcher can ever claim a given reminder.
+CLAIM_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('ZADD', KEYS[1], ARGV[1], id)
+end
+
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local claimed = {}
+for _, id in ipairs(due) do
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZADD', KEYS[2], ARGV[3], id)
+    table.insert(claimed, id)
+    table.insert(claimed, redis.call('HGET', KEYS[3], id) or '')
+end
+return claimed
+"""
+
+
+def schedule_reminder(wa_id, text, due_at):
+    """
+    Store a reminder for `due_at` (unix timestamp) and wake up a dispatcher.
+    """
+    reminder_id = uuid.uuid4().hex
+    pipeline = get_redis_client().pipeline()
+    pipeline.hset(DATA_KEY, reminder_id, json.dumps({"wa_id": wa_id, "text": text}))
+    pipeline.zadd(DUE_KEY, {reminder_id: due_at})
+    pipeline.lpush(WAKEUP_KEY, reminder_id)
+    pipeline.ltrim(WAKEUP_KEY, 0, 0)
+    pipeline.execute()
+    return reminder_id
+
+
+class ReminderDispatcher:
+    """
+    Fires due reminders from Redis in batches on a single thread.
+
+    The thread sleeps until the earliest due reminder, or until
+    schedule_reminder pushes a wakeup, capped at `max_idle` seconds so expired
+    leases are picked up even when nothing new is scheduled. Any number of
+    dispatchers can run across processes.
+    """
+
+    def __init__(self, send, batch_size=100, lease_seconds=60, max_idle=60):
+        self.send = send
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_idle = max_idle
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        self.batch_size = app.config["REMINDER_BATCH_SIZE"]
+        self.lease_seconds = app.config["REMINDER_LEASE_SECONDS"]
+        if app.config["REMINDER_DISPATCHER_ENABLED"]:
+            self.start()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="reminder-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                fired = self.dispatch_due()
+                if fired < self.batch_size:
+                    self._sleep_until_next()
+            except Exception:
+                logging.exception("Reminder dispatcher failed")
+                self._stop_event.wait(5)
+
+    def dispatch_due(self):
+        now = time.time()
+        claimed = get_redis_client().register_script(CLAIM_SCRIPT)(
+            keys=[DUE_KEY, INFLIGHT_KEY, DATA_KEY],
+            args=[now, self.batch_size, now + self.lease_seconds],
+        )
+        if not claimed:
+            return 0
+
+        reminder_ids = claimed[0::2]
+        futures = []
+        for payload in claimed[1::2]:
+            if payload:
+                reminder = json.loads(payload)
+                futures.append(runtime.submit(self.send(reminder["wa_id"], reminder["text"])))
+        wait(futures)
+
+        pipeline = get_redis_client().pipeline()
+        pipeline.zrem(INFLIGHT_KEY, *reminder_ids)
+        pipeline.hdel(DATA_KEY, *reminder_ids)
+        pipeline.execute()
+
+        logging.info(f"Sent {len(futures)} reminder(s)")
+        return len(reminder_ids)
+
+    def _sleep_until_next(self):
+        timeout = self.max_idle
+        next_due = get_redis_client().zrange(DUE_KEY, 0, 0, withscores=True)
+        if next_due:
+            timeout = min(max(next_due[0][1] - time.time(), 0), self.max_idle)
+        if timeout > 0:
+            get_redis_client().blpop(WAKEUP_KEY, timeout=timeout)
@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from .metrics import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+UPSTREAM_DURATION = metrics.histogram(
+    "whatsapp_upstream_duration_seconds",
+    "External API calls by service and outcome (ok, failed, error, client_error, timeout).",
+)
+UPSTREAM_RESPONSES = metrics.counter(
+    "whatsapp_upstream_responses_total", "HTTP responses from external APIs by service and status code."
+)
+UPSTREAM_REJECTED = metrics.counter(
+    "whatsapp_upstream_rejected_total", "Calls refused without reaching the API (circuit open, bulkhead full)."
+)
+
+
+def _status_code(error):
+    # aiohttp uses `status`, googleapiclient `status_code` (or `resp.status`), google.api_core `code`
+    for attribute in ("status", "status_code", "code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    status = getattr(getattr(error, "resp", None), "status", None)
+    return status if isinstance(status, int) else None
+
+
+def is_upstream_failure(error):
+    """
+    Whether an exception from an upstream call says the service is unhealthy:
+    timeouts, transport errors and 5xx responses. Anything else (a 4xx, a
+    prompt the SDK refuses to send, a safety block) is the caller's problem and
+    must not trip the breaker for everyone.
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, OSError)):
+        return True
+    status = _status_code(error)
+    if status is not None:
+        return status >= 500
+    # Connection errors of the HTTP clients that aren't OSErrors
+    return type(error).__module__.split(".")[0] in ("aiohttp", "httplib2")
+
+
+class ServiceUnavailable(Exception):
+    """
+    Raised without calling the upstream when its breaker is open or its bulkhead is full.
+    """
+
+    def __init__(self, service, reason):
+        super().__init__(f"{service} unavailable: {reason}")
+        self.service = service
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    Fails fast after `failure_threshold` consecutive failures.
+
+    After `reset_timeout` seconds one trial call is let through (half open):
+    success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def cancel_trial(self):
+        # The trial call never reached the upstream, let the next caller try instead
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if self.state != OPEN:
+                    self._set_state(OPEN)
+
+    def _set_state(self, state):
+        logging.warning(f"Circuit breaker '{self.name}' {self.state} -> {state}")
+        self.state = state
+
+
+class ExternalService:
+    """
+    Timeout, circuit breaker and bulkhead for one upstream API.
+
+    The bulkhead caps concurrent calls to this upstream only, so a slow or
+    dead service can tie up at most `max_concurrency` callers while everything
+    else keeps working. Callers wait at most `timeout` seconds for a slot.
+    """
+
+    def __init__(self, name, timeout=10, max_concurrency=10, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.in_flight = 0
+        self.configure(timeout, max_concurrency, failure_threshold, reset_timeout)
+
+    def configure(self, timeout, max_concurrency, failure_threshold=5, reset_timeout=30):
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.breaker.failure_threshold = failure_threshold
+        self.breaker.reset_timeout = reset_timeout
+        self.reset_bulkheads()
+
+    def reset_bulkheads(self):
+        # The asyncio semaphore binds to the loop it is first used on, so it is created there
+        self._async_slots = None
+        self._sync_slots = threading.BoundedSemaphore(self.max_concurrency)
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            UPSTREAM_REJECTED.inc(service=self.name, reason="circuit_open")
+            raise ServiceUnavailable(self.name, "circuit open")
+
+    def _reject_full(self):
+        self.breaker.cancel_trial()
+        UPSTREAM_REJECTED.inc(service=self.name, reason="bulkhead_full")
+        return ServiceUnavailable(self.name, "too many concurrent calls")
+
+    async def call(self, fn, *args, failed=None, failed_error=is_upstream_failure, **kwargs):
+        """
+        Await `fn(*args, **kwargs)` within the timeout. Timeouts, exceptions
+        for which `failed_error(error)` is true and results for which
+        `failed(result)` is true count as failures. Other exceptions are
+        re-raised without touching the breaker.
+        """
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+
+        self._check_breaker()
+        try:
+            await asyncio.wait_for(self._async_slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise self._reject_full() from None
+
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), self.timeout)
+        except asyncio.CancelledError:
+            self.breaker.cancel_trial()
+            raise
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            UPSTREAM_DURATION.observe(time.perf_counter() - start, service=self.name, outcome="timeout")
+            raise
+        except Exception as e:
+            self._record_error(e, failed_error, time.perf_counter() - start)
+            raise
+        finally:
+            self.in_flight -= 1
+            self._async_slots.release()
+
+        self._record_result(result, failed, time.perf_counter() - start)
+        return result
+
+    def call_sync(self, fn, *args, failed=None, failed_error=is_upstream_failure, **kwargs):
+        """
+        Blocking version of `call` for thread-based clients. The timeout must
+        be enforced by the client itself (e.g. a socket timeout), here it only
+        bounds the wait for a bulkhead slot.
+        """
+        self._check_breaker()
+        if not self._sync_slots.acquire(timeout=self.timeout):
+            raise self._reject_full()
+
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._record_error(e, failed_error, time.perf_counter() - start)
+            raise
+        finally:
+            self.in_flight -= 1
+            self._sync_slots.release()
+
+        self._record_result(result, failed, time.perf_counter() - start)
+        return result
+
+    def _record_error(self, error, failed_error, duration):
+        if failed_error(error):
+            self.breaker.record_failure()
+            outcome = "error"
+        else:
+            # Says nothing about the service's health, let the next call be the trial
+            self.breaker.cancel_trial()
+            outcome = "client_error"
+        UPSTREAM_DURATION.observe(duration, service=self.name, outcome=outcome)
+
+    def _record_result(self, result, failed, duration):
+        if failed is not None and failed(result):
+            self.breaker.record_failure()
+            outcome = "failed"
+        else:
+            self.breaker.record_success()
+            outcome = "ok"
+        UPSTREAM_DURATION.observe(duration, service=self.name, outcome=outcome)
+        # The HTTP clients here all return (status, ...) tuples
+        if isinstance(result, tuple) and result and isinstance(result[0], int):
+            UPSTREAM_RESPONSES.inc(service=self.name, status=result[0])
+
+    def snapshot(self):
+        return {
+            "state": self.breaker.state,
+            "failures": self.breaker.failures,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "timeout": self.timeout,
+        }
+
+
+class ExternalServices:
+    """
+    Registry of every upstream the bot calls, configured from EXTERNAL_SERVICES.
+    """
+
+    def __init__(self):
+        self._services = {}
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def init_app(self, app):
+        for name, settings in app.config["EXTERNAL_SERVICES"].items():
+            self.get(name).configure(
+                settings["timeout"],
+                settings["max_concurrency"],
+                app.config["BREAKER_FAILURE_THRESHOLD"],
+                app.config["BREAKER_RESET_TIMEOUT"],
+            )
+
+    def get(self, name):
+        service = self._services.get(name)
+        if service is None:
+            with self._lock:
+                service = self._services.setdefault(name, ExternalService(name))
+        return service
+
+    def snapshot(self):
+        return {name: service.snapshot() for name, service in self._services.items()}
+
+    def _reset_after_fork(self):
+        for service in self._services.values():
+            service.in_flight = 0
+            service.reset_bulkheads()
+
+
+external_services = ExternalServices()
+
+metrics.gauge(
+    "whatsapp_upstream_breaker_state",
+    "Circuit breaker state per external API in this process: 0 closed, 1 half open, 2 open.",
+    lambda: [
+        ({"service": name}, BREAKER_STATE_VALUES[state["state"]])
+        for name, state in external_services.snapshot().items()
+    ],
+)
+metrics.gauge(
+    "whatsapp_upstream_in_flight",
+    "External API calls in flight in this process.",
+    lambda: [({"service": name}, state["in_flight"]) for name, state in external_services.snapshot().items()],
+)
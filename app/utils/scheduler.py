@@ -0,0 +1,140 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from .metrics import metrics
+
+
+class Job:
+    def __init__(self, name, fn, next_run, interval=None, daily_at=None, tz=None):
+        self.name = name
+        self.fn = fn
+        self.next_run = next_run
+        self.interval = interval
+        self.daily_at = daily_at
+        self.tz = tz
+        self.cancelled = False
+
+    def reschedule(self, now):
+        """
+        Set `next_run` for recurring jobs, returns False for one-shot jobs.
+        """
+        if self.interval is not None:
+            self.next_run = max(self.next_run + self.interval, now)
+            return True
+        if self.daily_at is not None:
+            self.next_run = next_daily_run(self.daily_at, self.tz, now)
+            return True
+        return False
+
+
+def next_daily_run(time_str, tz, now):
+    """
+    Unix timestamp of the next "HH:MM" in timezone `tz` strictly after `now`.
+    """
+    timezone = pytz.timezone(tz)
+    hour, minute = (int(part) for part in time_str.split(":"))
+    local_now = datetime.fromtimestamp(now, timezone)
+    run_date = local_now.date()
+    while True:
+        run_at = timezone.localize(datetime(run_date.year, run_date.month, run_date.day, hour, minute))
+        if run_at.timestamp() > now:
+            return run_at.timestamp()
+        run_date += timedelta(days=1)
+
+
+class Scheduler:
+    """
+    In-process job scheduler backed by a heap of deadlines.
+
+    The thread sleeps until the earliest job is due (or a new job is added), so
+    it doesn't wake up at all while idle. Jobs run one at a time on the
+    scheduler thread and should hand anything slow off to a worker or the
+    asyncio runtime.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def _add(self, job):
+        with self._condition:
+            heapq.heappush(self._heap, (job.next_run, next(self._counter), job))
+            self._condition.notify()
+        return job
+
+    def at(self, timestamp, fn, name=None):
+        return self._add(Job(name or fn.__name__, fn, timestamp))
+
+    def every(self, seconds, fn, name=None, start_after=None):
+        first_run = time.time() + (seconds if start_after is None else start_after)
+        return self._add(Job(name or fn.__name__, fn, first_run, interval=seconds))
+
+    def daily_at(self, time_str, fn, tz="Asia/Kolkata", name=None):
+        next_run = next_daily_run(time_str, tz, time.time())
+        return self._add(Job(name or fn.__name__, fn, next_run, daily_at=time_str, tz=tz))
+
+    def cancel(self, job):
+        job.cancelled = True
+
+    def pending(self):
+        with self._condition:
+            return sum(1 for _, _, job in self._heap if not job.cancelled)
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _next_due_job(self):
+        with self._condition:
+            while not self._stopped:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                next_run, _, job = self._heap[0]
+                if job.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = next_run - time.time()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                return job
+        return None
+
+    def _run(self):
+        while True:
+            job = self._next_due_job()
+            if job is None:
+                return
+
+            try:
+                job.fn()
+            except Exception:
+                logging.exception(f"Scheduled job '{job.name}' failed")
+
+            if not job.cancelled and job.reschedule(time.time()):
+                self._add(job)
+
+
+scheduler = Scheduler()
+
+metrics.gauge("whatsapp_scheduler_pending_jobs", "Jobs waiting in this process's scheduler.", scheduler.pending)
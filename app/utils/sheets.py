@@ -0,0 +1,70 @@
+import os
+import threading
+
+from .resilience import external_services
+
+GOOGLE_CLOUD_CREDENTIALS_FILE = "google_cloud.json"
+GOOGLE_CLOUD_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+_google_cloud_credentials = None
+_google_cloud_lock = threading.Lock()
+_google_sheets = threading.local()
+_sheets_api_endpoint = None
+
+
+def init_sheets(app):
+    global _sheets_api_endpoint
+    _sheets_api_endpoint = app.config["SHEETS_API_BASE_URL"]
+
+
+def get_google_cloud_credentials():
+    global _google_cloud_credentials
+    if _google_cloud_credentials is None:
+        with _google_cloud_lock:
+            if _google_cloud_credentials is None:
+                from google.oauth2 import service_account
+
+                _google_cloud_credentials = service_account.Credentials.from_service_account_file(
+                    GOOGLE_CLOUD_CREDENTIALS_FILE, scopes=GOOGLE_CLOUD_SCOPES
+                )
+    return _google_cloud_credentials
+
+
+def set_google_cloud_credentials(credentials):
+    """
+    Replace the service account credentials, e.g. with anonymous ones in benchmarks.
+    """
+    global _google_cloud_credentials
+    with _google_cloud_lock:
+        _google_cloud_credentials = credentials
+
+
+def get_sheets_service():
+    """
+    Google Sheets client for the calling thread, built on first use.
+
+    The client's httplib2 connection is not thread-safe, so each thread (and
+    each forked process) gets its own; the credentials are shared. Its socket
+    timeout is the "sheets" external service timeout.
+    """
+    service = getattr(_google_sheets, "service", None)
+    if service is None:
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build
+
+        http = AuthorizedHttp(
+            get_google_cloud_credentials(), http=httplib2.Http(timeout=external_services.get("sheets").timeout)
+        )
+        client_options = {"api_endpoint": _sheets_api_endpoint} if _sheets_api_endpoint else None
+        service = build("sheets", "v4", http=http, cache_discovery=False, client_options=client_options)
+        _google_sheets.service = service
+    return service
+
+
+def _reset_sheets_after_fork():
+    global _google_sheets
+    _google_sheets = threading.local()
+
+
+os.register_at_fork(after_in_child=_reset_sheets_after_fork)
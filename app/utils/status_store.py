@@ -0,0 +1,112 @@
+import atexit
+import logging
+import threading
+import time
+
+from .redis_utils import get_redis_client
+
+# Statuses only ever move forward, a late "delivered" must not overwrite "read"
+STATUS_RANK = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+
+# KEYS[1] is the per-status counter hash, KEYS[2..] the per-message hashes.
+# ARGV[1] is the TTL, then status, rank, timestamp, recipient per message.
+STORE_SCRIPT = """
+for i = 2, #KEYS do
+    local arg = 2 + (i - 2) * 4
+    local current = tonumber(redis.call('HGET', KEYS[i], 'rank') or '0')
+    if tonumber(ARGV[arg + 1]) > current then
+        redis.call('HSET', KEYS[i], 'status', ARGV[arg], 'rank', ARGV[arg + 1], 'ts', ARGV[arg + 2], 'to', ARGV[arg + 3])
+        redis.call('EXPIRE', KEYS[i], ARGV[1])
+    end
+    redis.call('HINCRBY', KEYS[1], ARGV[arg], 1)
+end
+return #KEYS - 1
+"""
+
+COUNTS_KEY = "whatsapp:status:counts"
+
+
+def _status_key(message_id):
+    return f"whatsapp:status:{message_id}"
+
+
+class StatusStore:
+    """
+    Buffers delivery status callbacks (sent/delivered/read/failed) in memory and
+    writes them to Redis in batches, one script call per batch.
+
+    Flushes when `batch_size` statuses are buffered, or `flush_interval`
+    seconds after the first status buffered since the last flush. That flush
+    is a one-shot scheduler job, so an empty buffer never wakes the scheduler.
+    """
+
+    def __init__(self, batch_size=200, ttl=604800, flush_interval=2):
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._scheduler = None
+        self._flush_scheduled = False
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app, scheduler):
+        self.batch_size = app.config["STATUS_BATCH_SIZE"]
+        self.ttl = app.config["STATUS_TTL"]
+        self.flush_interval = app.config["STATUS_FLUSH_INTERVAL"]
+        self._scheduler = scheduler
+        atexit.register(self.flush)
+
+    def record(self, statuses):
+        for status in statuses:
+            if status.get("status") == "failed":
+                logging.warning(f"Message {status.get('id')} failed: {status.get('errors')}")
+
+        with self._lock:
+            for status in statuses:
+                self._buffer.append(
+                    (
+                        status.get("id"),
+                        status.get("status"),
+                        status.get("timestamp", ""),
+                        status.get("recipient_id", ""),
+                    )
+                )
+            should_flush = len(self._buffer) >= self.batch_size
+            should_schedule = bool(self._buffer) and not should_flush and not self._flush_scheduled
+            if should_schedule:
+                self._flush_scheduled = True
+        if should_flush:
+            self.flush()
+        elif should_schedule and self._scheduler is not None:
+            self._scheduler.at(time.time() + self.flush_interval, self.flush, name="status_flush")
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            self._flush_scheduled = False
+        if not batch:
+            return 0
+
+        keys = [COUNTS_KEY]
+        args = [self.ttl]
+        for message_id, status, timestamp, recipient_id in batch:
+            if not message_id or status not in STATUS_RANK:
+                continue
+            keys.append(_status_key(message_id))
+            args += [status, STATUS_RANK[status], timestamp, recipient_id]
+
+        if len(keys) == 1:
+            return 0
+
+        try:
+            return get_redis_client().register_script(STORE_SCRIPT)(keys=keys, args=args)
+        except Exception:
+            logging.exception(f"Failed to store {len(batch)} status update(s)")
+            return 0
+
+    def get_status(self, message_id):
+        status = get_redis_client().hgetall(_status_key(message_id))
+        return {key.decode("utf-8"): value.decode("utf-8") for key, value in status.items()}
+
+
+status_store = StatusStore()
@@ -0,0 +1,57 @@
+import logging
+import os
+import threading
+import time
+
+from .async_runtime import runtime
+from .gemini_utils import warm_up_gemini
+from .graph_client import graph_client
+from .redis_utils import get_redis_client
+from .sheets import GOOGLE_CLOUD_CREDENTIALS_FILE, get_google_cloud_credentials
+
+
+def _warm_up_sheets():
+    if not os.path.exists(GOOGLE_CLOUD_CREDENTIALS_FILE):
+        logging.info(f"{GOOGLE_CLOUD_CREDENTIALS_FILE} not found, skipping Google Sheets warm-up")
+        return
+    # Sheets services are per thread, the client library and credentials are what can be shared
+    import googleapiclient.discovery  # noqa: F401
+
+    get_google_cloud_credentials()
+
+
+def warm_up(app):
+    """
+    Pay the one-off costs (Gemini SDK import, Sheets discovery, Redis and Graph
+    API connections) up front instead of on the first message that needs them.
+
+    Each step is independent, a failure is logged and the first real use retries it.
+    """
+    steps = [
+        ("redis", lambda: get_redis_client().ping()),
+        ("graph session", lambda: runtime.run(graph_client.open())),
+        ("gemini", lambda: warm_up_gemini(app)),
+        ("google sheets", _warm_up_sheets),
+    ]
+    for name, step in steps:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logging.exception(f"Warm-up step '{name}' failed")
+            continue
+        logging.info(f"Warm-up step '{name}' took {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+def start_warm_up(app):
+    """
+    Run `warm_up` according to WARM_UP: "background" (default) returns immediately,
+    "eager" blocks until done and "off" leaves everything to first use.
+    """
+    mode = app.config["WARM_UP"]
+    if mode == "eager":
+        warm_up(app)
+    elif mode == "background":
+        threading.Thread(target=warm_up, args=(app,), name="warm-up", daemon=True).start()
+    elif mode != "off":
+        logging.warning(f"Unknown WARM_UP mode '{mode}', skipping warm-up")
@@ -3,20 +3,39 @@ from flask import current_app, jsonify
 import json
 import re
 import os
-import aiohttp
 import asyncio
 from dotenv import load_dotenv
-import requests
-import time
-import schedule
-import threading
 from datetime import datetime, timedelta
-import base64
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-import redis
 import pytz
 
+from .async_runtime import runtime
+from .broadcast import start_broadcast
+from .dedup import deduplicator
+from .command_router import CommandRouter, command_args, split_command
+from .counters import CounterSet
+from .gemini_utils import (
+    clear_history,
+    get_cached_reply,
+    get_model,
+    is_standalone_question,
+    load_history,
+    response_cache_key,
+    save_turn,
+    set_cached_reply,
+    to_chat_history,
+)
+from .graph_client import graph_client
+from .image_generation import get_cached_media_id, set_cached_media_id, text_to_image
+from .image_search import ImageSearchUnavailable, next_image_url
+from .leader import leader
+from .ledger import money_ledger
+from .metrics import metrics
+from .redis_utils import get_redis_client
+from .reminders import ReminderDispatcher, schedule_reminder
+from .resilience import ServiceUnavailable, external_services
+from .scheduler import scheduler
+from .youtube_mp3 import extract_video_id, mp3_converter
+
 
 
 load_dotenv()
@@ -25,53 +44,10 @@ AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 GOOGLE_CLOUD_API_KEY = os.getenv("GOOGLE_CLOUD_API_KEY")
 unsplash_api_key = os.getenv("UNSPLASH_API_KEY")
 stability_ai_api_key = os.getenv("STABILITY_AI_API_KEY")
-imgbb_api_key = os.getenv("IMGBB_API_KEY")
-
-
-chaitanya_counter_path = (
-    r"C:\coding projects\whatsapp_bot\app\utils\chaitanya_counter.txt"
-)
-image_storage_path = r"C:\1\2\\"
-
-redis_client = redis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379"), ssl_cert_reqs=None)
-
-GOOGLE_CLOUD_CREDENTIALS_FILE = "google_cloud.json"
-GOOGLE_CLOUD_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
-
-google_cloud_credentials = service_account.Credentials.from_service_account_file(
-    GOOGLE_CLOUD_CREDENTIALS_FILE, scopes=GOOGLE_CLOUD_SCOPES
-)
-
-google_sheets_service = build("sheets", "v4", credentials=google_cloud_credentials)
-
-import google.generativeai as genai
 
 
 def run_asyncio_coroutine(coroutine):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        loop.run_until_complete(coroutine)
-    finally:
-        loop.close()
-
-
-def log_http_response(response):
-    logging.info(f"Status: {response.status_code}")
-    logging.info(f"Content-type: {response.headers.get('content-type')}")
-    logging.info(f"Body: {response.text}")
-
-
-def schedule_runner():  # This function will run forever checking for scheduled tasks
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
-
-
-my_thread = threading.Thread(
-    target=schedule_runner
-)  # Create a thread for the schedule_runner function
-my_thread.start()
+    return runtime.run(coroutine)
 
 
 def get_text_message_input(recipient, text):
@@ -98,80 +74,160 @@ def get_image_message_input(recipient, img_url):
     return data
 
 
-def gemini_reply(message_body, wa_id):
-    load_dotenv()
-    genai.configure(api_key=current_app.config["GEMINI_API_KEY"])
-
-    # Set up the model
-    generation_config = {
-        "temperature": 0.9,
-        "top_p": 1,
-        "top_k": 1,
-        "max_output_tokens": 2048,
+def get_media_image_message_input(recipient, media_id):
+    data = {
+        "messaging_product": "whatsapp",
+        "to": recipient,
+        "type": "image",
+        "image": {
+            "id": media_id,
+        },
     }
+    return data
 
-    safety_settings = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"},
-    ]
-
-    model = genai.GenerativeModel(
-        model_name="gemini-pro",
-        generation_config=generation_config,
-        safety_settings=safety_settings,
-    )
 
-    modified_message_body = (
-        message_body.replace("/ai", "").replace("/AI", "").replace("/bard", "").strip()
-    )
-    response = model.generate_content(modified_message_body)
+def gemini_reply(message_body, wa_id):
+    config = current_app.config
+    model = get_model(config["GEMINI_API_KEY"], config["GEMINI_MODEL"], config["GEMINI_API_ENDPOINT"])
+
+    modified_message_body = command_args(message_body)
 
-    if not response.candidates:
-        data = get_text_message_input(wa_id, "No response was generated.")
+    if modified_message_body == "":
+        data = get_text_message_input(wa_id, "Please enter a question.")
         run_asyncio_coroutine(send_message(data))
         return
 
-    responseprocessed = process_text_for_whatsapp(response.text)
-    data = get_text_message_input(wa_id, responseprocessed)
+    if modified_message_body.lower() == "reset":
+        clear_history(wa_id)
+        run_asyncio_coroutine(
+            send_message(get_text_message_input(wa_id, "Conversation cleared."))
+        )
+        return
 
-    run_asyncio_coroutine(send_message(data))
+    history = load_history(wa_id, config["GEMINI_HISTORY_TOKEN_BUDGET"])
 
+    # Self-contained questions are answered from the cache even mid-conversation,
+    # but only replies generated without any history are stored in it
+    cache_key = None
+    reply = None
+    command_token = split_command(message_body)[0].casefold()
+    if (
+        config["GEMINI_CACHE_ENABLED"]
+        and command_token not in config["GEMINI_CACHE_BYPASS_COMMANDS"]
+        and is_standalone_question(modified_message_body)
+    ):
+        cache_key = response_cache_key(config["GEMINI_MODEL"], modified_message_body)
+        reply = get_cached_reply(cache_key)
 
-def bus_schedule(wa_id):
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
+    already_sent = False
+    if reply is None:
+        chat = model.start_chat(history=to_chat_history(history))
+        gemini = external_services.get("gemini")
+        request_options = {"timeout": gemini.timeout}
 
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
+        try:
+            if config["GEMINI_STREAMING"]:
+                reply = gemini.call_sync(
+                    stream_gemini_reply,
+                    chat,
+                    modified_message_body,
+                    wa_id,
+                    config["GEMINI_STREAM_MIN_CHUNK"],
+                    request_options,
+                )
+                already_sent = True
+            else:
+                response = gemini.call_sync(
+                    chat.send_message, modified_message_body, request_options=request_options
+                )
+                reply = response.text if response.candidates else ""
+        except ServiceUnavailable:
+            logging.warning("Gemini unavailable, not calling it")
+            data = get_text_message_input(wa_id, "The AI is unavailable right now, please try again in a bit.")
+            run_asyncio_coroutine(send_message(data))
+            return
+
+        if not reply:
+            data = get_text_message_input(wa_id, "No response was generated.")
+            run_asyncio_coroutine(send_message(data))
+            return
+
+        if cache_key is not None and not history:
+            set_cached_reply(cache_key, reply, config["GEMINI_CACHE_TTL"])
+
+    save_turn(
+        wa_id,
+        modified_message_body,
+        reply,
+        config["GEMINI_HISTORY_TOKEN_BUDGET"],
+        config["GEMINI_HISTORY_TTL"],
+    )
+
+    if not already_sent:
+        send_text_chunks(wa_id, reply)
 
+
+def bus_schedule(wa_id):
     data = get_image_message_input(wa_id, "https://i.ibb.co/PYJXF6k/bus-schedule.jpg")
 
-    response = requests.post(url, headers=headers, json=data)
+    graph_client.send_sync(data)
 
-    print(response.text)
 
+# Images that can be requested with a command and pushed daily, keyed by config prefix
+DAILY_IMAGES = {
+    "mess": "MESS_MENU",
+    "tt": "TIMETABLE",
+}
 
-def chaitanya_counter(wa_id, message_body):
-    with open(chaitanya_counter_path, "r") as file:
-        count = [int(num) for num in file.readline().split()[:3]]
 
-    if message_body == "count":
+def send_daily_image(name, wa_id):
+    img_url = current_app.config[f"{DAILY_IMAGES[name]}_IMAGE_URL"]
+    if not img_url:
         run_asyncio_coroutine(
-            send_message(
-                get_text_message_input(
-                    wa_id,
-                    f"Cold Drink: {count[0]}\nChips: {count[1]}\nIce Cream: {count[2]}",
-                )
+            send_message(get_text_message_input(wa_id, "Not available right now."))
+        )
+        return
+    graph_client.send_sync(get_image_message_input(wa_id, img_url))
+
+
+def push_image_once(name, recipients, img_url, tz):
+    # Only the leader runs pushes; the Redis key still guards the short overlap when leadership moves
+    today = datetime.now(pytz.timezone(tz)).strftime("%Y-%m-%d")
+    if not get_redis_client().set(f"push:{name}:{today}", "1", nx=True, ex=86400):
+        return
+    for recipient in recipients:
+        runtime.submit(graph_client.send(get_image_message_input(recipient, img_url)))
+
+
+def schedule_daily_pushes(app):
+    recipients = app.config["PUSH_RECIPIENTS"]
+    for name, prefix in DAILY_IMAGES.items():
+        push_time = app.config[f"{prefix}_PUSH_TIME"]
+        img_url = app.config[f"{prefix}_IMAGE_URL"]
+        if push_time and img_url and recipients:
+            scheduler.daily_at(
+                push_time,
+                leader.only(
+                    lambda name=name, img_url=img_url: push_image_once(
+                        name, recipients, img_url, app.config["TIMEZONE"]
+                    )
+                ),
+                tz=app.config["TIMEZONE"],
+                name=f"{name}_push",
             )
+
+
+def counter_command(counter_set, wa_id, message_body):
+    if message_body == "count":
+        counts = counter_set.get_counts()
+        run_asyncio_coroutine(
+            send_message(get_text_message_input(wa_id, counter_set.format_counts(counts)))
         )
         return
 
     split_message = message_body.rsplit(" ", 1)
 
-    if len(split_message) != 2:
+    if len(split_message) != 2 or not split_message[1].lstrip("-").isdigit():
         run_asyncio_coroutine(
             send_message(get_text_message_input(wa_id, "Invalid input."))
         )
@@ -180,229 +236,150 @@ def chaitanya_counter(wa_id, message_body):
     action = split_message[0].lower()
     number = int(split_message[1])
 
-    if action == "colddrink" or action == "cold drink":
-        count[0] += number
-        with open(chaitanya_counter_path, "w") as file:
-            file.write(f"{count[0]} {count[1]} {count[2]}")
-    elif action == "chips":
-        count[1] += number
-        with open(chaitanya_counter_path, "w") as file:
-            file.write(f"{count[0]} {count[1]} {count[2]}")
-    elif action == "icecream" or action == "ice cream":
-        count[2] += number
-        with open(chaitanya_counter_path, "w") as file:
-            file.write(f"{count[0]} {count[1]} {count[2]}")
-    else:
+    label = counter_set.resolve(action)
+    if label is None:
         run_asyncio_coroutine(
             send_message(get_text_message_input(wa_id, "Invalid action."))
         )
         return
 
+    counts = counter_set.increment(label, number)
+
     run_asyncio_coroutine(
         send_message(
             get_text_message_input(
                 wa_id,
-                f"{action} count updated.\nCurrent count-\nCold Drink: {count[0]}\nChips: {count[1]}\nIce Cream: {count[2]}",
+                f"{action} count updated.\nCurrent count-\n{counter_set.format_counts(counts)}",
             )
         )
     )
 
 
-def youtube_mp3(message_body, wa_id):
-    querystring = {
-        "url": message_body.replace("/youtubemp3", "")
-        .replace("/youtube", "")
-        .replace("/mp3", "")
-        .replace("/yt", "")
-        .strip()
-    }
-
-    url = "https://youtube-mp3-downloader2.p.rapidapi.com/ytmp3/ytmp3/"
+def register_counter_commands(counter_sets):
+    """
+    Register a "/<name>" command for every counter set, e.g. COUNTER_SETS from config.
+    """
+    for name, counters in counter_sets.items():
+        counter_set = CounterSet(name, counters)
+        router.register(
+            name,
+            [f"/{name}"],
+            lambda message_body, wa_id, counter_set=counter_set: counter_command(
+                counter_set, wa_id, command_args(message_body)
+            ),
+        )
 
-    headers = {
-        "X-RapidAPI-Key": "RAPID_API_KEY_HERE",
-        "X-RapidAPI-Host": "youtube-mp3-downloader2.p.rapidapi.com",
-    }
 
-    response = requests.get(url, headers=headers, params=querystring)
+async def convert_and_send_mp3(video_id, wa_id):
+    try:
+        link = await mp3_converter.get_cached_link(video_id)
+        if link is None:
+            await send_message(get_text_message_input(wa_id, "Converting your video, this can take a minute..."))
+            link = await mp3_converter.convert(video_id)
+    except Exception:
+        logging.exception(f"MP3 conversion failed for {video_id}")
+        link = None
+
+    if link is None:
+        await send_message(get_text_message_input(wa_id, "Error occurred while converting the mp3."))
+        return
+    await send_message(get_text_message_input(wa_id, "Download link: " + link))
 
-    if response.status_code == 200:
-        data = get_text_message_input(
-            wa_id, "Download link: " + response.json()["link"]
-        )
-        run_asyncio_coroutine(send_message(data))
-    else:
-        data = get_text_message_input(wa_id, "Error occurred while converting the mp3.")
-        run_asyncio_coroutine(send_message(data))
 
+def youtube_mp3(message_body, wa_id):
+    video_id = extract_video_id(command_args(message_body))
 
-def upload_image_to_imgbb(image_path):
-    url = "https://api.imgbb.com/1/upload"
+    if video_id is None:
+        data = get_text_message_input(wa_id, "Please send a valid YouTube link.")
+        run_asyncio_coroutine(send_message(data))
+        return
 
-    payload = {
-        "key": imgbb_api_key,
-        "image": base64.b64encode(open(image_path, "rb").read()),
-    }
+    # Conversions are slow, the runtime loop waits for them instead of this thread
+    runtime.submit(convert_and_send_mp3(video_id, wa_id))
 
-    response = requests.post(url, payload)
-    data = response.json()
 
-    if response.status_code == 200:
-        return data["data"]["url"]
-    else:
-        print(f"Error: {response.status_code} - {response.text}")
-        return None
+async def generate_and_send_image(prompt, wa_id, cache_ttl, base_url):
+    try:
+        media_id = await get_cached_media_id(prompt)
+        if media_id is None:
+            image = await text_to_image(prompt, stability_ai_api_key, base_url=base_url)
+            if image is None:
+                await send_message(get_text_message_input(wa_id, "Error occurred while generating the image."))
+                return
+
+            # Straight from memory to WhatsApp, the image never touches disk or a third-party host
+            media_id = await graph_client.upload_media(image, "image/png", "generated.png")
+            if media_id is None:
+                await send_message(get_text_message_input(wa_id, "Error occurred while uploading."))
+                return
+            await set_cached_media_id(prompt, media_id, cache_ttl)
+
+        await graph_client.send(get_media_image_message_input(wa_id, media_id))
+    except Exception:
+        logging.exception(f"Image generation failed for {wa_id}")
+        await send_message(get_text_message_input(wa_id, "Error occurred while generating the image."))
 
 
 def generate_img(message_body, wa_id):
-    prompt = message_body.replace("/generate", "").replace("/gen", "").strip()
+    prompt = command_args(message_body)
 
     if prompt == "":
         data = get_text_message_input(wa_id, "Please enter a prompt.")
         run_asyncio_coroutine(send_message(data))
         return
 
-    response = requests.post(
-        f"https://api.stability.ai/v1/generation/stable-diffusion-v1-6/text-to-image",
-        headers={
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "Authorization": f"Bearer {stability_ai_api_key}",
-        },
-        json={
-            "text_prompts": [
-                {
-                    "text": prompt,
-                }
-            ],
-            "cfg_scale": 7,
-            "height": 1024,
-            "width": 1024,
-            "samples": 1,
-            "steps": 30,
-        },
+    # Generation takes several seconds, let the runtime loop wait for it instead of this thread
+    config = current_app.config
+    runtime.submit(
+        generate_and_send_image(prompt, wa_id, config["GEN_CACHE_TTL"], config["STABILITY_API_BASE_URL"])
     )
 
-    if response.status_code != 200:
-        raise Exception("Non-200 response: " + str(response.text))
-
-    data = response.json()
-
-    file_name = int(time.time())
-    image = data["artifacts"][0]["base64"]
-
-    with open(rf"{image_storage_path}{file_name}.png", "wb") as f:
-        f.write(base64.b64decode(image))
-
-    img_url = upload_image_to_imgbb(rf"{image_storage_path}{file_name}.png")
-
-    if img_url is None:
-        data = get_text_message_input(wa_id, "Error occurred while uploading.")
-        run_asyncio_coroutine(send_message(data))
-        return
-
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
-    data = get_image_message_input(wa_id, img_url)
-
-    response = requests.post(url, headers=headers, json=data)
 
-    print(response.text)
-
-    os.remove(rf"{image_storage_path}{file_name}.png")
+# Sign of a "give" for each party, the balance is kept from the first party's side
+MONEY_GIVE_SIGN = {
+    919: 1,
+    918: -1,
+}
 
 
 def manage_money(message_body, wa_id):
-    message_parts = message_body.replace("/money", "").replace("/m", "").strip().split(" ", 2)
+    message_parts = command_args(message_body).split(" ", 2)
     action = message_parts[0].lower()
     amount = int(message_parts[1])
-    message = message_parts[2]
-
-    current_balance = 0
-
-    GOOGLE_SHEET_ID = "Google_Sheet_ID_Here"
-    GOOGLE_SHEET_RANGE = "A1:A1"
-
-    google_sheet = google_sheets_service.spreadsheets()
-    google_sheet_result = (
-        google_sheet.values()
-        .get(spreadsheetId=GOOGLE_SHEET_ID, range=GOOGLE_SHEET_RANGE)
-        .execute()
-    )
-    google_sheet_values = google_sheet_result.get("values", [])
-
-    if not google_sheet_values:
-        print("No data found.")
-    else:
-        current_balance = int(google_sheet_values[0][0])
-
-    if int(wa_id) == 919:
-
-        if action == "take":
-            current_balance -= amount
-        elif action == "give":
-            current_balance += amount
-        else:
-            data = get_text_message_input(wa_id, "Invalid action.")
-            run_asyncio_coroutine(send_message(data))
-            return
-
-    elif int(wa_id) == 918:
-        if action == "take":
-            current_balance += amount
-        elif action == "give":
-            current_balance -= amount
-        else:
-            data = get_text_message_input(wa_id, "Invalid action.")
-            run_asyncio_coroutine(send_message(data))
-            return
+    message = message_parts[2] if len(message_parts) > 2 else ""
 
-    else:
+    give_sign = MONEY_GIVE_SIGN.get(int(wa_id))
+    if give_sign is None:
         data = get_text_message_input(wa_id, "Not authorized.")
         run_asyncio_coroutine(send_message(data))
         return
 
-    new_google_sheet_value = [[current_balance]]
-    google_sheet_body = {
-        "range": GOOGLE_SHEET_RANGE,
-        "majorDimension": "ROWS",
-        "values": new_google_sheet_value,
-    }
+    if action == "give":
+        delta = give_sign * amount
+    elif action == "take":
+        delta = -give_sign * amount
+    else:
+        data = get_text_message_input(wa_id, "Invalid action.")
+        run_asyncio_coroutine(send_message(data))
+        return
 
-    google_sheet_update_result = (
-        google_sheet.values()
-        .update(
-            spreadsheetId=GOOGLE_SHEET_ID,
-            range=GOOGLE_SHEET_RANGE,
-            valueInputOption="RAW",
-            body=google_sheet_body,
-        )
-        .execute()
-    )
+    if money_ledger.record(wa_id, action, amount, delta, message) is None:
+        data = get_text_message_input(wa_id, "Balance is not available right now, try again later.")
+    else:
+        data = get_text_message_input(wa_id, "Action successful")
+    run_asyncio_coroutine(send_message(data))
 
-    data = get_text_message_input(wa_id, f"Action successful")
 
 def money_balance(wa_id):
-    GOOGLE_SHEET_ID = "Google_Sheet_ID_Here"
-    GOOGLE_SHEET_RANGE = "A1:A1"
-
-    google_sheet = google_sheets_service.spreadsheets()
-    google_sheet_result = (
-        google_sheet.values()
-        .get(spreadsheetId=GOOGLE_SHEET_ID, range=GOOGLE_SHEET_RANGE)
-        .execute()
-    )
-    google_sheet_values = google_sheet_result.get("values", [])
-
-    if not google_sheet_values:
-        print("No data found.")
-    else:
-        current_balance = int(google_sheet_values[0][0])
+    if int(wa_id) not in MONEY_GIVE_SIGN:
+        data = get_text_message_input(wa_id, "Not authorized.")
+        run_asyncio_coroutine(send_message(data))
+        return
 
-    if int(wa_id) == 919:
+    current_balance = money_ledger.get_balance()
+    if current_balance is None:
+        message_txt = "Balance is not available right now, try again later."
+    elif int(wa_id) == 919:
         if current_balance < 0:
             message_txt = "You have to take " + str(abs(current_balance)) + " from chaitanya"
         elif current_balance > 0:
@@ -439,7 +416,7 @@ def convert_to_server_time(time_str, user_tz='Asia/Kolkata', server_tz='UTC'):
     server_timezone = pytz.timezone(server_tz)
     
     # Parse the input time string into a naive datetime object
-    naive_user_time = datetime.strptime(time_str, "%H:%M")
+    naive_user_time = datetime.strptime(time_str, "%Y-%m-%d %H:%M")
     
     # Localize the naive datetime object to the user's timezone
     user_time = user_timezone.localize(naive_user_time)
@@ -450,7 +427,7 @@ def convert_to_server_time(time_str, user_tz='Asia/Kolkata', server_tz='UTC'):
     return server_time
 
 def reminder(message_body, wa_id):
-    message_parts = message_body.replace("/reminder", "").strip().split(" ", 3)
+    message_parts = command_args(message_body).split(" ", 3)
     date = message_parts[0]
     time = message_parts[1] + " " + message_parts[2]
     message = message_parts[3]
@@ -468,9 +445,8 @@ def reminder(message_body, wa_id):
             )
         )
 
-        delay = (server_datetime - datetime.now(pytz.utc)).total_seconds()
-        if delay > 0:
-            threading.Timer(delay, lambda: send_reminder(wa_id, message)).start()
+        if server_datetime > datetime.now(pytz.utc):
+            schedule_reminder(wa_id, message, server_datetime.timestamp())
             run_asyncio_coroutine(
                 send_message_outside_app(get_text_message_input(wa_id, "Reminder Set"))
             )
@@ -485,113 +461,79 @@ def reminder(message_body, wa_id):
             )
         )
 
-def send_reminder(wa_id, text):
+async def send_reminder(wa_id, text):
     data = get_text_message_input(wa_id, text)
-    run_asyncio_coroutine(send_message_outside_app(data))
+    await send_message_outside_app(data)
+
+
+reminder_dispatcher = ReminderDispatcher(send_reminder)
 
 
 # endregion
 
 
 def search_image(message_body, wa_id):
-    modified_message_body = message_body.replace("/image", "").replace("/img", "").replace("/photo", "").strip()
-    url = f"https://api.unsplash.com/search/photos?query={modified_message_body}&client_id={unsplash_api_key}&per_page=1"
-
-    response = requests.get(url)
-    data = response.json()
+    query = command_args(message_body)
+    if query == "":
+        run_asyncio_coroutine(send_message(get_text_message_input(wa_id, "Please enter a search term.")))
+        return
 
-    if response.status_code == 200:
-        if int(response.headers["X-Ratelimit-Remaining"]) == 0:
-            reset_time = int(response.headers["X-Ratelimit-Reset"])
-            reset_time = datetime.datetime.fromtimestamp(reset_time).strftime(
-                "%Y-%m-%d %H:%M:%S"
+    config = current_app.config
+    try:
+        img = run_asyncio_coroutine(
+            next_image_url(
+                query,
+                unsplash_api_key,
+                config["UNSPLASH_PAGE_SIZE"],
+                config["UNSPLASH_CACHE_TTL"],
+                config["UNSPLASH_RATE_LIMIT_RESERVE"],
+                config["UNSPLASH_API_BASE_URL"],
             )
-
-            run_asyncio_coroutine(
-                send_message(
-                    get_text_message_input(
-                        wa_id,
-                        f"Rate limit reached. Please try again after {reset_time}.",
-                    )
-                )
+        )
+    except ImageSearchUnavailable as e:
+        minutes = max(e.retry_after // 60, 1)
+        run_asyncio_coroutine(
+            send_message(
+                get_text_message_input(wa_id, f"Image search is busy. Please try again in {minutes} minute(s).")
             )
-        else:
-            for photo in data["results"]:
-                img = photo["urls"]["regular"] + ".jpg"
-                url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
-                headers = {
-                    "Content-type": "application/json",
-                    "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-                }
-                data = get_image_message_input(wa_id, img)
-
-                response = requests.post(url, headers=headers, json=data)
-
-                print(response.text)
-    else:
-        send_message("Error occurred while searching for images.")
-
-
-async def send_message_to_all(text):
+        )
+        return
+    except Exception:
+        logging.exception(f"Image search failed for {query!r}")
+        run_asyncio_coroutine(
+            send_message(get_text_message_input(wa_id, "Error occurred while searching for images."))
+        )
+        return
 
-    all_mobile_nos = [
-        919,
-        915,
-        911,
-        918,
-        915,
-    ]
+    if img is None:
+        run_asyncio_coroutine(send_message(get_text_message_input(wa_id, "No images found.")))
+        return
 
-    for mobile_no in all_mobile_nos:
-        await send_message_outside_app(get_text_message_input(mobile_no, text))
-        await asyncio.sleep(0.5)
+    graph_client.send_sync(get_image_message_input(wa_id, img))
+
+
+def send_message_to_all(text, group="all"):
+    """
+    Broadcast `text` to a recipient group in the background, returns (broadcast_id, recipient_count).
+    """
+    config = current_app.config
+    return start_broadcast(
+        group,
+        lambda wa_id: get_text_message_input(wa_id, text),
+        send_message_outside_app,
+        config["BROADCAST_RATE"],
+        config["BROADCAST_CONCURRENCY"],
+        config["BROADCAST_RESULTS_TTL"],
+    )
 
 
 async def send_message(data):
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
-
-    async with aiohttp.ClientSession() as session:
-        url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
-        try:
-            async with session.post(url, data=data, headers=headers) as response:
-                if response.status == 200:
-                    print("Status:", response.status)
-                    print("Content-type:", response.headers["content-type"])
-
-                    html = await response.text()
-                    print("Body:", html)
-                else:
-                    print(response.status)
-                    print(response)
-        except aiohttp.ClientConnectorError as e:
-            print("Connection Error", str(e))
+    return await graph_client.send(data)
 
 
 async def send_message_outside_app(data):
-    load_dotenv()
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {os.getenv('ACCESS_TOKEN')}",
-    }
-
-    async with aiohttp.ClientSession() as session:
-        url = f"GRAPH_API_URL_"
-        try:
-            async with session.post(url, data=data, headers=headers) as response:
-                if response.status == 200:
-                    print("Status:", response.status)
-                    print("Content-type:", response.headers["content-type"])
-
-                    html = await response.text()
-                    print("Body:", html)
-                else:
-                    print(response.status)
-                    print(response)
-        except aiohttp.ClientConnectorError as e:
-            print("Connection Error", str(e))
+    # graph_client holds its own copy of the config, so this works without an app context
+    return await graph_client.send(data)
 
 
 def process_text_for_whatsapp(text):
@@ -605,99 +547,224 @@ def process_text_for_whatsapp(text):
     return whatsapp_style_text
 
 
-def blue_tick(message_id):
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
+WHATSAPP_TEXT_LIMIT = 4096
+SENTENCE_ENDINGS = (". ", "! ", "? ", ".\n", "!\n", "?\n")
 
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
 
-    data = {
-        "messaging_product": "whatsapp",
-        "status": "read",
-        "message_id": message_id,
-    }
+def find_flush_point(text, min_size, limit=WHATSAPP_TEXT_LIMIT):
+    """
+    Where to cut `text` so the first part can go out as its own message.
 
-    response = requests.post(url, headers=headers, json=data)
+    Prefers the last paragraph break, then the last sentence end, at or after
+    `min_size` and within `limit`. Returns None while more text should be
+    buffered, and only hard-cuts at a space once the buffer reaches `limit`.
+    """
+    window = text[:limit]
 
-    if response.status_code == 200:
-        print(response.json())
-    else:
-        print("Blue tick failed with status code:", response.status_code)
+    paragraph = window.rfind("\n\n")
+    if paragraph >= min_size:
+        return paragraph + 2
 
+    sentence = max(window.rfind(ending) for ending in SENTENCE_ENDINGS)
+    if sentence >= min_size:
+        return sentence + 2
 
-def process_whatsapp_message(body):
-    wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
-    # name = body["entry"][0]["changes"][0]["value"]["contacts"][0]["profile"]["name"]
-    message = body["entry"][0]["changes"][0]["value"]["messages"][0]
-    message_body = message["text"]["body"]
-    message_id = message["id"]
+    if len(text) >= limit:
+        space = window.rfind(" ")
+        return space + 1 if space > 0 else limit
+    return None
 
-    # use "in message_body" for each string seprarately
 
-    if "/help" in message_body or "/Help" in message_body or "/HELP" in message_body:
-        help_text = "Welcome to the WhatsApp Bot!\n\nHere are some available commands:\n/help - Display this help message\n/ai - Activate AI chatbot\n/bus timetable - Get bus timetable\n/image - Search for an image\n/all - Send a message to all users\n/reminder - Set a reminder\n/chaitanya - Counter for Chaitanya\n/youtubemp3 - Convert YouTube video to MP3\n/gen - Generate an image\n/mess - Get today's mess menu\n/tt - Get class timetable\n\nFeel free to explore and interact with the bot!"
-        run_asyncio_coroutine(send_message(get_text_message_input(wa_id, help_text)))
+def split_for_whatsapp(text, limit=WHATSAPP_TEXT_LIMIT):
+    chunks = []
+    while len(text) > limit:
+        cut = find_flush_point(text, 1, limit)
+        chunks.append(text[:cut])
+        text = text[cut:]
+    chunks.append(text)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
 
-    elif "/ai" in message_body or "/AI" in message_body or "/bard" in message_body:
-        gemini_reply(message_body, wa_id)
 
-    elif (
-        "/bus timetable" in message_body
-        or "/bus schedule" in message_body
-        or "/bus" in message_body
-    ):
-        bus_schedule(wa_id)
+def send_text_chunks(wa_id, text):
+    for chunk in split_for_whatsapp(process_text_for_whatsapp(text)):
+        run_asyncio_coroutine(send_message(get_text_message_input(wa_id, chunk)))
 
-    elif "/all" in message_body:
-        run_asyncio_coroutine(
-            send_message_to_all(message_body.replace("/all", "").strip())
+
+async def _send_after(previous, data):
+    # Keeps streamed chunks in order without making the stream wait for each send
+    if previous is not None:
+        await asyncio.wrap_future(previous)
+    await send_message(data)
+
+
+def stream_gemini_reply(chat, prompt, wa_id, min_chunk, request_options=None):
+    """
+    Send a Gemini reply as it is generated, one WhatsApp message per paragraph
+    or sentence group. Returns the full reply text ("" if nothing was generated).
+    """
+    reply = []
+    buffer = ""
+    last_send = None
+
+    def flush(text):
+        nonlocal last_send
+        text = process_text_for_whatsapp(text)
+        if text:
+            last_send = runtime.submit(_send_after(last_send, get_text_message_input(wa_id, text)))
+
+    for chunk in chat.send_message(prompt, stream=True, request_options=request_options):
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without parts, e.g. the final one carrying only the finish reason
+            continue
+        reply.append(text)
+        buffer += text
+
+        cut = find_flush_point(buffer, min_chunk)
+        while cut is not None:
+            flush(buffer[:cut])
+            buffer = buffer[cut:]
+            cut = find_flush_point(buffer, min_chunk)
+
+    for text in split_for_whatsapp(buffer):
+        flush(text)
+
+    if last_send is not None:
+        last_send.result()
+    return "".join(reply)
+
+
+router = CommandRouter()
+
+COMMAND_DURATION = metrics.histogram(
+    "whatsapp_command_duration_seconds",
+    "Time each command handler holds the dispatching thread, by command.",
+)
+
+
+@router.command("help", "/help")
+def send_help(message_body, wa_id):
+    help_text = "Welcome to the WhatsApp Bot!\n\nHere are some available commands:\n/help - Display this help message\n/ai - Activate AI chatbot (/ai reset to start over)\n/bus timetable - Get bus timetable\n/image - Search for an image\n/all - Send a message to all users\n/reminder - Set a reminder\n/chaitanya - Counter for Chaitanya\n/youtubemp3 - Convert YouTube video to MP3\n/gen - Generate an image\n/mess - Get today's mess menu\n/tt - Get class timetable\n\nFeel free to explore and interact with the bot!"
+    run_asyncio_coroutine(send_message(get_text_message_input(wa_id, help_text)))
+
+
+@router.command("bus", "/bus")
+def send_bus_schedule(message_body, wa_id):
+    bus_schedule(wa_id)
+
+
+@router.command("all", "/all")
+def send_to_all(message_body, wa_id):
+    # "/all #group text" targets a group, plain "/all text" goes to the "all" group
+    text = command_args(message_body)
+    group = "all"
+    if text.startswith("#"):
+        group, _, text = text[1:].partition(" ")
+        text = text.strip()
+
+    if not text:
+        run_asyncio_coroutine(send_message(get_text_message_input(wa_id, "Please enter a message.")))
+        return
+
+    broadcast_id, recipient_count = send_message_to_all(text, group)
+    run_asyncio_coroutine(
+        send_message(
+            get_text_message_input(
+                wa_id, f"Broadcasting to {recipient_count} recipient(s) in '{group}' (id {broadcast_id})."
+            )
         )
+    )
 
-    elif "/reminder" in message_body:
-        reminder(message_body, wa_id)
 
-    elif "/chaitanya" in message_body:
-        chaitanya_counter(wa_id, message_body.replace("/chaitanya", "").strip())
+@router.command("mess", "/mess")
+def send_mess_menu(message_body, wa_id):
+    send_daily_image("mess", wa_id)
 
-    elif (
-        "/youtubemp3" in message_body
-        or "/youtube" in message_body
-        or "/mp3" in message_body
-        or "/yt" in message_body
-    ):
-        youtube_mp3(message_body, wa_id)
 
-    elif "/generate" in message_body or "/gen" in message_body:
-        generate_img(message_body, wa_id)
+@router.command("tt", "/tt", "/timetable")
+def send_timetable(message_body, wa_id):
+    send_daily_image("tt", wa_id)
+
+
+@router.command("balance", "/balance")
+def send_money_balance(message_body, wa_id):
+    money_balance(wa_id)
+
 
-    elif "/image" in message_body or "/img" in message_body or "/photo" in message_body:
-        search_image(message_body, wa_id)
+router.register("ai", ["/ai", "/AI", "/bard"], gemini_reply)
+router.register("reminder", ["/reminder"], reminder)
+router.register("youtubemp3", ["/youtubemp3", "/youtube", "/mp3", "/yt"], youtube_mp3)
+router.register("gen", ["/gen", "/generate"], generate_img)
+router.register("image", ["/image", "/img", "/photo"], search_image)
+router.register("money", ["/money", "/m"], manage_money)
 
-    elif "/money" in message_body or "/m" in message_body:
-        manage_money(message_body, wa_id)
 
-    elif "/balance" in message_body:
-        money_balance(wa_id)
+def iter_change_values(body):
+    for entry in body.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value")
+            if value:
+                yield value
 
-    blue_tick(message_id)
+
+def get_message_events(body):
+    """
+    Flatten every message of every entry/change in a webhook body into
+    {"wa_id": ..., "message": ...} events, in the order Meta sent them.
+    """
+    events = []
+    for value in iter_change_values(body):
+        contacts = value.get("contacts") or [{}]
+        for message in value.get("messages") or []:
+            wa_id = message.get("from") or contacts[0].get("wa_id")
+            events.append({"wa_id": wa_id, "message": message})
+    return events
+
+
+def get_status_updates(body):
+    statuses = []
+    for value in iter_change_values(body):
+        statuses.extend(value.get("statuses") or [])
+    return statuses
+
+
+def process_message_event(event):
+    wa_id = event["wa_id"]
+    message = event["message"]
+    message_id = message["id"]
+
+    if message.get("type", "text") != "text":
+        logging.info(f"Ignoring unsupported {message.get('type')} message {message_id}")
+        return
+
+    message_body = message["text"]["body"]
+
+    command = router.resolve(message_body)
+    if command is not None:
+        with COMMAND_DURATION.time(command=command.name):
+            command.handler(message_body, wa_id)
+
+
+def process_whatsapp_message(body):
+    for event in get_message_events(body):
+        process_message_event(event)
 
 
 def is_valid_whatsapp_message(body):
-    if (
-        body.get("object")
-        and body.get("entry")
-        and body["entry"][0].get("changes")
-        and body["entry"][0]["changes"][0].get("value")
-        and body["entry"][0]["changes"][0]["value"].get("messages")
-    ):
-        message_id = body["entry"][0]["changes"][0]["value"]["messages"][0]["id"]
+    return bool(body.get("object")) and any(
+        value.get("messages") for value in iter_change_values(body)
+    )
 
-        if not redis_client.exists(message_id):
-            redis_client.setex(message_id, 43200, "1")  # expire after 12 hours
-            return True
-        else:
-            return False
 
-    return False
+def filter_new_messages(events):
+    """
+    Drop events whose message ID was already seen, checking the whole batch in
+    one atomic Redis round trip (see dedup.py).
+    """
+    if not events:
+        return events
+
+    is_new = deduplicator.filter_new([event["message"]["id"] for event in events])
+
+    return [event for event, new in zip(events, is_new) if new]
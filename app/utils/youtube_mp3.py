@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import math
+import re
+import time
+from urllib.parse import parse_qs, urlparse
+
+from .http_session import get_http_session
+from .redis_utils import get_async_redis_client
+from .resilience import external_services
+
+RAPIDAPI_HOST = "youtube-mp3-downloader2.p.rapidapi.com"
+# Seconds on top of the RapidAPI waits for the Redis round trips around a conversion
+LOCK_MARGIN = 10
+
+VIDEO_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{11}$")
+YOUTUBE_HOSTS = {"youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com", "youtube-nocookie.com"}
+
+
+def extract_video_id(text):
+    """
+    Video ID from any common YouTube link form (watch, youtu.be, shorts,
+    embed, live) or a bare ID, None if there isn't one.
+    """
+    text = text.strip()
+    if VIDEO_ID_PATTERN.match(text):
+        return text
+
+    parsed = urlparse(text if "://" in text else f"https://{text}")
+    host = (parsed.hostname or "").lower()
+    path_parts = [part for part in parsed.path.split("/") if part]
+
+    candidate = None
+    if host in ("youtu.be", "www.youtu.be"):
+        candidate = path_parts[0] if path_parts else None
+    elif host in YOUTUBE_HOSTS or host.endswith(".youtube.com"):
+        if path_parts[:1] == ["watch"]:
+            candidate = parse_qs(parsed.query).get("v", [None])[0]
+        elif len(path_parts) >= 2 and path_parts[0] in ("shorts", "embed", "live", "v"):
+            candidate = path_parts[1]
+
+    if candidate and VIDEO_ID_PATTERN.match(candidate):
+        return candidate
+    return None
+
+
+def _link_key(video_id):
+    return f"ytmp3:link:{video_id}"
+
+
+def _lock_key(video_id):
+    return f"ytmp3:lock:{video_id}"
+
+
+class Mp3Converter:
+    """
+    YouTube to MP3 conversion through RapidAPI, cached and coalesced per video.
+
+    Download links are cached in Redis by video ID. Concurrent requests for
+    the same video share one upstream call: within a process they await the
+    same future, across processes a Redis lock lets one caller convert
+    while the others wait for the cached link.
+    """
+
+    def __init__(self):
+        self.api_key = None
+        self.base_url = f"https://{RAPIDAPI_HOST}"
+        self.cache_ttl = 3600
+        self.lock_timeout = 2 * 45 + LOCK_MARGIN
+        self.poll_interval = 0.5
+        # video_id -> asyncio.Future, only touched from the runtime loop
+        self._inflight = {}
+
+    def init_app(self, app):
+        self.api_key = app.config["RAPIDAPI_KEY"]
+        self.base_url = app.config["RAPIDAPI_BASE_URL"]
+        self.cache_ttl = app.config["YOUTUBE_MP3_CACHE_TTL"]
+        # The lock must outlive the longest conversion: waiting for a bulkhead slot
+        # and then the call itself can each take up to RAPIDAPI_TIMEOUT
+        rapidapi_timeout = app.config["EXTERNAL_SERVICES"]["rapidapi"]["timeout"]
+        self.lock_timeout = math.ceil(2 * rapidapi_timeout) + LOCK_MARGIN
+
+    async def get_cached_link(self, video_id):
+        link = await get_async_redis_client().get(_link_key(video_id))
+        return link.decode("utf-8") if link else None
+
+    async def convert(self, video_id):
+        """
+        Download link for `video_id`, or None if the conversion failed.
+        """
+        future = self._inflight.get(video_id)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[video_id] = future
+        try:
+            link = await self._convert_once(video_id)
+            future.set_result(link)
+            return link
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved so an exception nobody else awaited isn't reported as lost
+            future.exception()
+            raise
+        finally:
+            del self._inflight[video_id]
+            if not future.done():
+                # The call was cancelled, fail the callers sharing it instead of leaving them waiting
+                future.set_exception(RuntimeError(f"Conversion of {video_id} was cancelled"))
+                future.exception()
+
+    async def _convert_once(self, video_id):
+        redis_client = get_async_redis_client()
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            link = await self.get_cached_link(video_id)
+            if link is not None:
+                return link
+
+            if await redis_client.set(_lock_key(video_id), "1", nx=True, ex=self.lock_timeout):
+                try:
+                    link = await self._request_link(video_id)
+                    if link is not None:
+                        await redis_client.set(_link_key(video_id), link, ex=self.cache_ttl)
+                    return link
+                finally:
+                    await redis_client.delete(_lock_key(video_id))
+
+            # Another process is converting this video, wait for its result
+            await asyncio.sleep(self.poll_interval)
+
+        logging.warning(f"Timed out waiting for another conversion of {video_id}")
+        return None
+
+    async def _request(self, video_id):
+        async with get_http_session().get(
+            f"{self.base_url}/ytmp3/ytmp3/",
+            params={"url": f"https://www.youtube.com/watch?v={video_id}"},
+            headers={"X-RapidAPI-Key": self.api_key, "X-RapidAPI-Host": RAPIDAPI_HOST},
+        ) as response:
+            if response.status != 200:
+                return response.status, await response.text()
+            return response.status, await response.json(content_type=None)
+
+    async def _request_link(self, video_id):
+        if not self.api_key:
+            logging.error("RAPIDAPI_KEY not set, can't convert videos")
+            return None
+        status, data = await external_services.get("rapidapi").call(
+            self._request, video_id, failed=lambda result: result[0] >= 500
+        )
+        if status != 200:
+            logging.error(f"MP3 conversion of {video_id} returned {status}: {data}")
+            return None
+        return data.get("link")
+
+
+mp3_converter = Mp3Converter()
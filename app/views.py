@@ -1,47 +1,107 @@
 import logging
 import json
+import time
 
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, g, request, jsonify, current_app
 
-from .decorators.security import signature_required
+from .decorators.security import admin_signature_required, metrics_token_required, signature_required
 from .utils.whatsapp_utils import (
-    process_whatsapp_message,
+    filter_new_messages,
+    get_message_events,
+    get_status_updates,
     is_valid_whatsapp_message,
 )
+from .utils.message_queue import dispatch_events, enqueue_events, tag_profile
+from .utils.metrics import metrics
+from .utils.profiling import collapsed_stacks, profiler
+from .utils.read_receipts import read_receipts
+from .utils.status_store import status_store
 
 webhook_blueprint = Blueprint("webhook", __name__)
+metrics_blueprint = Blueprint("metrics", __name__)
+debug_blueprint = Blueprint("debug", __name__, url_prefix="/debug")
+
+WEBHOOK_DURATION = metrics.histogram(
+    "whatsapp_webhook_duration_seconds", "Webhook requests from receipt to response, by method and status code."
+)
+STATUSES_RECEIVED = metrics.counter(
+    "whatsapp_statuses_received_total", "Delivery status callbacks received, by status."
+)
+
+
+@webhook_blueprint.before_request
+def start_timer():
+    g.webhook_start = time.perf_counter()
+    mode = profiler.should_profile(request.headers.get("X-Admin-Signature"))
+    if mode is not None:
+        g.profile = profiler.start(forced=mode == "forced")
+
+
+@webhook_blueprint.after_request
+def record_duration(response):
+    WEBHOOK_DURATION.observe(
+        time.perf_counter() - g.webhook_start, method=request.method, status=response.status_code
+    )
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profiler.stop(profile, request.path, response.status_code)
+    return response
+
+
+@webhook_blueprint.teardown_request
+def stop_profile_on_error(exc):
+    # after_request is skipped when the view raised
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profiler.stop(profile, request.path, 500)
 
 
 def handle_message():
     """
     Every message send will trigger 4 HTTP requests to your webhook: message, sent, delivered, read.
+    Meta may also batch several messages and statuses, across entries and changes, into one request.
 
     Returns:
         response: A tuple containing a JSON response and an HTTP status code.
     """
+    raw_body = request.get_data()
+    # Parsed once from the bytes the signature check already read, and reused from here on
     body = request.get_json()
     # logging.info(f"request body: {body}")
 
-    # Check if it's a WhatsApp status update
-    if (
-        body.get("entry", [{}])[0]
-        .get("changes", [{}])[0]
-        .get("value", {})
-        .get("statuses")
-    ):
-        logging.info("Received a WhatsApp status update.")
-        return jsonify({"status": "ok"}), 200
-
     try:
-        if is_valid_whatsapp_message(body):
-            process_whatsapp_message(body)
-            return jsonify({"status": "ok"}), 200
-        else:
+        # Status updates are most webhooks, buffer them for the status store in one go
+        statuses = get_status_updates(body)
+        if statuses:
+            status_store.record(statuses)
+            for status in statuses:
+                STATUSES_RECEIVED.inc(status=status.get("status"))
+
+        # Cheap check on the raw bytes before walking the payload for messages
+        if b'"messages"' not in raw_body or not is_valid_whatsapp_message(body):
+            if statuses:
+                return jsonify({"status": "ok"}), 200
             # if the request is not a WhatsApp API event, return an error
             return (
                 jsonify({"status": "error", "message": "Not a WhatsApp API event"}),
                 404,
             )
+
+        # Retried deliveries are acknowledged too, otherwise Meta keeps retrying them
+        events = filter_new_messages(get_message_events(body))
+        if profiler.current() is not None:
+            if statuses:
+                profiler.tag(command="statuses")
+            tag_profile(events)
+        if events:
+            # Blue ticks go out now, in the background, not after the command has run
+            read_receipts.mark_read(events)
+            if current_app.config["PROCESSING_MODE"] == "queue":
+                # Acknowledge right away, worker.py does the slow part
+                enqueue_events(events)
+            else:
+                dispatch_events(events)
+        return jsonify({"status": "ok"}), 200
     except json.JSONDecodeError:
         logging.error("Failed to decode JSON")
         return jsonify({"status": "error", "message": "Invalid JSON provided"}), 400
@@ -80,3 +140,27 @@ def webhook_post():
     return handle_message()
 
 
+@debug_blueprint.route("/profiles", methods=["GET"])
+@admin_signature_required
+def profiles_get():
+    limit = request.args.get("limit", 20, type=int)
+    return jsonify({"profiles": profiler.slowest(limit)}), 200
+
+
+@debug_blueprint.route("/profiles/<profile_id>", methods=["GET"])
+@admin_signature_required
+def profile_get(profile_id):
+    profile = profiler.load(profile_id)
+    if profile is None:
+        return jsonify({"status": "error", "message": "Profile not found"}), 404
+    return Response(collapsed_stacks(profile), mimetype="text/plain")
+
+
+@metrics_blueprint.route("/metrics", methods=["GET"])
+@metrics_token_required
+def metrics_get():
+    if not current_app.config["METRICS_ENABLED"]:
+        return jsonify({"status": "error", "message": "Metrics are disabled"}), 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
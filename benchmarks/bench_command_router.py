@@ -0,0 +1,86 @@
+"""
+Micro-benchmark for command dispatch.
+
+Compares the old substring if/elif chain from process_whatsapp_message with
+CommandRouter.resolve over a mix of realistic messages.
+
+    python benchmarks/bench_command_router.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.whatsapp_utils import register_counter_commands, router  # noqa: E402
+
+# Counter commands are registered from COUNTER_SETS by create_app()
+register_counter_commands({"chaitanya": {}})
+
+MESSAGES = [
+    "/help",
+    "/ai what is the capital of France?",
+    "/AI summarise this paragraph for me please " + "lorem ipsum " * 20,
+    "/bus timetable",
+    "/reminder 2024-05-01 10:30 AM submit assignment",
+    "/chaitanya chips 2",
+    "/yt https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "/gen a watercolor painting of a lighthouse at dusk",
+    "/image mountains",
+    "/money give 200 lunch",
+    "/balance",
+    "hello there, how are you doing today?",
+    "/ai " + "please explain this long forwarded message in simple words. " * 30,
+    "long forwarded chat message with no command in it at all. " * 30,
+]
+
+def legacy_dispatch(message_body):
+    if "/help" in message_body or "/Help" in message_body or "/HELP" in message_body:
+        return "help"
+    elif "/ai" in message_body or "/AI" in message_body or "/bard" in message_body:
+        return "ai"
+    elif (
+        "/bus timetable" in message_body
+        or "/bus schedule" in message_body
+        or "/bus" in message_body
+    ):
+        return "bus"
+    elif "/all" in message_body:
+        return "all"
+    elif "/reminder" in message_body:
+        return "reminder"
+    elif "/chaitanya" in message_body:
+        return "chaitanya"
+    elif (
+        "/youtubemp3" in message_body
+        or "/youtube" in message_body
+        or "/mp3" in message_body
+        or "/yt" in message_body
+    ):
+        return "youtubemp3"
+    elif "/generate" in message_body or "/gen" in message_body:
+        return "gen"
+    elif "/image" in message_body or "/img" in message_body or "/photo" in message_body:
+        return "image"
+    elif "/money" in message_body or "/m" in message_body:
+        return "money"
+    elif "/balance" in message_body:
+        return "balance"
+    return None
+
+
+def bench(label, fn, number):
+    total = min(timeit.repeat(lambda: [fn(m) for m in MESSAGES], number=number, repeat=5))
+    per_message_ns = total / (number * len(MESSAGES)) * 1e9
+    print(f"{label:<10} {per_message_ns:8.0f} ns/message")
+
+
+if __name__ == "__main__":
+    for message in MESSAGES:
+        command = router.resolve(message)
+        legacy = legacy_dispatch(message)
+        if (command.name if command else None) != legacy:
+            print(f"note: {message[:40]!r} -> router={command and command.name} legacy={legacy}")
+
+    bench("legacy", legacy_dispatch, 20000)
+    bench("router", router.resolve, 20000)
@@ -0,0 +1,159 @@
+"""
+Webhook throughput: Flask dev server (run.py) vs gunicorn (wsgi.py).
+
+Starts an in-memory Redis (fakeredis over TCP, in its own process), then each
+server in turn with PROCESSING_MODE=queue, and posts signed webhook messages
+with unique IDs from concurrent keep-alive clients. Every request takes the
+production web path: signature check, dedup in Redis, LPUSH to the queue.
+
+    python benchmarks/bench_serving.py [requests] [clients]
+
+Gunicorn settings come from gunicorn.conf.py and the usual env vars
+(WEB_CONCURRENCY, GUNICORN_THREADS).
+"""
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_SECRET = "bench-secret"
+REDIS_PORT = 16379
+SERVER_PORT = 15000
+
+SERVERS = {
+    "dev server": [sys.executable, "run.py"],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "wsgi:app", "-c", "gunicorn.conf.py"],
+}
+
+
+def serve_redis(port):
+    from fakeredis import TcpFakeServer
+
+    TcpFakeServer(("127.0.0.1", port)).serve_forever()
+
+
+def signed_body(message_id):
+    raw = json.dumps(
+        {
+            "object": "whatsapp_business_account",
+            "entry": [
+                {
+                    "changes": [
+                        {
+                            "value": {
+                                "contacts": [{"wa_id": "15550001111"}],
+                                "messages": [
+                                    {"id": message_id, "from": "15550001111", "type": "text", "text": {"body": "/help"}}
+                                ],
+                            }
+                        }
+                    ]
+                }
+            ],
+        }
+    ).encode()
+    signature = hmac.new(APP_SECRET.encode(), raw, hashlib.sha256).hexdigest()
+    return raw, {"Content-Type": "application/json", "X-Hub-Signature-256": f"sha256={signature}"}
+
+
+def wait_until_up(timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", SERVER_PORT, timeout=1)
+            connection.request("GET", "/webhook")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+def run_client(count, latencies, errors):
+    connection = http.client.HTTPConnection("127.0.0.1", SERVER_PORT, timeout=30)
+    for _ in range(count):
+        raw, headers = signed_body(f"wamid.{uuid.uuid4().hex}")
+        start = time.perf_counter()
+        try:
+            connection.request("POST", "/webhook", body=raw, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            if response.getheader("Connection", "").lower() == "close":
+                connection.close()
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", SERVER_PORT, timeout=30)
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def bench(label, command, env, requests, clients):
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up()
+        # Warm every worker (and its Redis connections) before measuring
+        run_client(50, [], [])
+
+        latencies, errors = [], []
+        per_client = requests // clients
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            for _ in range(clients):
+                executor.submit(run_client, per_client, latencies, errors)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    quantiles = statistics.quantiles([latency * 1000 for latency in latencies], n=100)
+    print(
+        f"{label:<12} {len(latencies) / elapsed:8.0f} req/s   "
+        f"p50 {quantiles[49]:6.1f} ms   p95 {quantiles[94]:6.1f} ms   p99 {quantiles[98]:6.1f} ms   "
+        f"errors {len(errors)}"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--redis":
+        serve_redis(int(sys.argv[2]))
+        sys.exit()
+
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    env = dict(os.environ)
+    env.update(
+        PORT=str(SERVER_PORT),
+        REDIS_URL=f"redis://127.0.0.1:{REDIS_PORT}",
+        APP_SECRET=APP_SECRET,
+        PROCESSING_MODE="queue",
+        SCHEDULER_ENABLED="false",
+        REMINDER_DISPATCHER_ENABLED="false",
+        WARM_UP="off",
+        # Only the web path is measured: no receipts to the real Graph API, no
+        # rate limiter round trips on the benchmarked Redis
+        READ_RECEIPTS_ENABLED="false",
+        GRAPH_RATE_LIMIT="0",
+        GUNICORN_ACCESS_LOG="",
+        GUNICORN_LOG_LEVEL="warning",
+    )
+
+    redis_server = subprocess.Popen([sys.executable, __file__, "--redis", str(REDIS_PORT)])
+    try:
+        time.sleep(1)
+        print(f"{requests} requests, {clients} clients, {os.cpu_count()} CPU(s)")
+        for label, command in SERVERS.items():
+            bench(label, command, env, requests, clients)
+    finally:
+        redis_server.terminate()
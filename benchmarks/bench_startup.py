@@ -0,0 +1,54 @@
+"""
+Cold-start benchmark.
+
+Times `import app` and `create_app()` in fresh interpreters, so module import
+side effects are included in every run.
+
+    python benchmarks/bench_startup.py [runs]
+
+WARM_UP defaults to "off" here to measure the cold path; set it to "eager"
+to see the full cost moved up front.
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+print(imported - start, created - imported)
+"""
+
+
+def run_once(env):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    import_seconds, create_seconds = map(float, output.split()[-2:])
+    return import_seconds, create_seconds
+
+
+def report(label, samples):
+    samples_ms = [sample * 1000 for sample in samples]
+    print(f"{label:<12} median {statistics.median(samples_ms):7.1f} ms   min {min(samples_ms):7.1f} ms")
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    env = dict(os.environ)
+    env.setdefault("WARM_UP", "off")
+    env.setdefault("SCHEDULER_ENABLED", "false")
+    env.setdefault("REMINDER_DISPATCHER_ENABLED", "false")
+
+    results = [run_once(env) for _ in range(runs)]
+    print(f"{runs} runs, WARM_UP={env['WARM_UP']}")
+    report("import", [r[0] for r in results])
+    report("create_app", [r[1] for r in results])
+    report("total", [r[0] + r[1] for r in results])
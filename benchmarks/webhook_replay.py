@@ -0,0 +1,346 @@
+"""
+End-to-end webhook replay against local stand-ins for every upstream.
+
+Builds the app with create_app() in this process, on an in-memory Redis
+(fakeredis), with the Graph API, Gemini, Stability AI, Unsplash, RapidAPI
+and Google Sheets all answered by one local aiohttp stub server that adds
+--latency-ms to every response. A seeded corpus of signed webhook bodies is
+then posted at --rate requests per second (0 = as fast as the --clients
+allow):
+
+- text commands (/help, /ai, /image, /gen, /yt, /chaitanya, /money, /balance, plain text)
+- delivery status callbacks, several per body
+- batched bodies with several entries and senders
+- duplicates, re-sent bodies whose message IDs were already processed
+
+Messages are processed inline (PROCESSING_MODE=inline), so a request's
+latency includes running its commands; work handed to the asyncio runtime
+(/gen, /yt, read receipts) is awaited before outbound calls are counted.
+With a fixed rate, latency is measured from each request's scheduled start,
+so queueing behind slow requests is included.
+
+    python benchmarks/webhook_replay.py [--requests 2000] [--rate 0] [--clients 8] [--latency-ms 20]
+
+Needs fakeredis with Lua support: pip install "fakeredis[lua]"
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+APP_SECRET = "bench-secret"
+STUB_PORT = 15080
+STUB_URL = f"http://127.0.0.1:{STUB_PORT}"
+PHONE_NUMBER_ID = "15550000000"
+MONEY_SENDER = "919"
+
+QUESTIONS = ["what is redis?", "explain webhooks", "summarise the news", "tell me a joke", "what is asyncio?"]
+QUERIES = ["mountains", "red fox", "city at night", "ocean", "coffee"]
+PROMPTS = ["a lighthouse at dusk", "a cat astronaut", "a watercolor forest"]
+VIDEOS = ["dQw4w9WgXcQ", "9bZkp7q19f0", "kJQP7kiw5Fk"]
+# A 1x1 PNG, Stability's answer to every prompt
+PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c4890000000d49444154789c6360000002"
+    "000154a24f5d0000000049454e44ae426082"
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=2000, help="webhook requests to send")
+    parser.add_argument("--rate", type=float, default=0, help="requests per second, 0 for unthrottled")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent senders")
+    parser.add_argument("--latency-ms", type=float, default=20, help="latency added by every stub upstream")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="share of requests re-sending an old body")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def configure_environment():
+    # Must happen before the app is imported, some modules read the environment at import time
+    os.environ.update(
+        APP_SECRET=APP_SECRET,
+        ACCESS_TOKEN="bench-token",
+        VERSION="v19.0",
+        PHONE_NUMBER_ID=PHONE_NUMBER_ID,
+        VERIFY_TOKEN="bench",
+        GEMINI_API_KEY="bench-key",
+        STABILITY_AI_API_KEY="bench-key",
+        UNSPLASH_API_KEY="bench-key",
+        RAPIDAPI_KEY="bench-key",
+        MONEY_SHEET_ID="bench-sheet",
+        GRAPH_API_BASE_URL=STUB_URL,
+        GEMINI_API_ENDPOINT=STUB_URL,
+        STABILITY_API_BASE_URL=STUB_URL,
+        UNSPLASH_API_BASE_URL=STUB_URL,
+        RAPIDAPI_BASE_URL=STUB_URL,
+        SHEETS_API_BASE_URL=STUB_URL + "/",
+        PROCESSING_MODE="inline",
+        WARM_UP="off",
+        SCHEDULER_ENABLED="false",
+        REMINDER_DISPATCHER_ENABLED="false",
+    )
+    # The Graph API limiter would cap throughput at the production send rate
+    os.environ.setdefault("GRAPH_RATE_LIMIT", "0")
+
+
+class StubUpstreams:
+    """
+    One aiohttp server standing in for every upstream, counting calls per route.
+
+    `name` may be a function of the request body, to tell calls on one route apart.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = Counter()
+        self.last_call = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+            self.last_call = time.monotonic()
+
+    def route(self, name, respond):
+        async def handler(request):
+            body = await request.read()
+            self._count(name(body) if callable(name) else name)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return respond(request)
+
+        return handler
+
+    def start(self):
+        from aiohttp import web
+
+        def graph_messages(request):
+            return web.json_response({"messaging_product": "whatsapp", "messages": [{"id": "wamid.bench"}]})
+
+        def gemini(request):
+            return web.json_response(
+                {
+                    "candidates": [
+                        {
+                            "content": {"role": "model", "parts": [{"text": "A stand-in answer from the benchmark."}]},
+                            "finishReason": "STOP",
+                            "index": 0,
+                        }
+                    ]
+                }
+            )
+
+        def unsplash(request):
+            query = request.query.get("query", "")
+            results = [{"urls": {"regular": f"https://images.example/{query}/{index}"}} for index in range(10)]
+            return web.json_response({"results": results}, headers={"X-Ratelimit-Remaining": "49"})
+
+        app = web.Application()
+        app.router.add_post(
+            "/{version}/{phone}/messages",
+            self.route(
+                lambda body: "graph receipts" if b'"status": "read"' in body else "graph messages", graph_messages
+            ),
+        )
+        app.router.add_post(
+            "/{version}/{phone}/media", self.route("graph media", lambda request: web.json_response({"id": "media"}))
+        )
+        app.router.add_post("/v1beta/models/{model}", self.route("gemini", gemini))
+        app.router.add_post(
+            "/v1/generation/{engine}/text-to-image",
+            self.route("stability", lambda request: web.Response(body=PNG, content_type="image/png")),
+        )
+        app.router.add_get("/search/photos", self.route("unsplash", unsplash))
+        app.router.add_get(
+            "/ytmp3/ytmp3/",
+            self.route("rapidapi", lambda request: web.json_response({"link": "https://files.example/song.mp3"})),
+        )
+        app.router.add_get(
+            "/v4/spreadsheets/{sheet}/values/{range}",
+            self.route("sheets", lambda request: web.json_response({"values": [["0"]]})),
+        )
+        # values/<range>:append and values:batchUpdate
+        app.router.add_post(
+            "/v4/spreadsheets/{sheet}/{path:.+}", self.route("sheets", lambda request: web.json_response({}))
+        )
+
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(app, access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", STUB_PORT).start())
+        threading.Thread(target=loop.run_forever, name="stub-upstreams", daemon=True).start()
+
+    def wait_until_idle(self, quiet=1.0, timeout=60):
+        """
+        Wait for background work to finish: no upstream call for `quiet` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and time.monotonic() - self.last_call < quiet:
+            time.sleep(0.1)
+
+
+def message_body(rng):
+    return rng.choice(
+        [
+            "/help",
+            f"/ai {rng.choice(QUESTIONS)}",
+            f"/image {rng.choice(QUERIES)}",
+            f"/gen {rng.choice(PROMPTS)}",
+            f"/yt https://youtu.be/{rng.choice(VIDEOS)}",
+            "/chaitanya chips 1",
+            "/chaitanya count",
+            "hello there",
+        ]
+    )
+
+
+def webhook(values):
+    return {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": value}]} for value in values]}
+
+
+def build_corpus(count, duplicate_share, seed):
+    """
+    [(kind, body bytes)] for `count` requests, reproducible for a given seed.
+    """
+    rng = random.Random(seed)
+    ids = (f"wamid.{seed}.{index}" for index in range(10**9))
+    corpus = []
+    for _ in range(count):
+        roll = rng.random()
+        if corpus and roll < duplicate_share:
+            kind, body = "duplicate", rng.choice([body for kind, body in corpus if kind in ("text", "batched")])
+            corpus.append((kind, body))
+            continue
+
+        roll = rng.random()
+        if roll < 0.45:
+            sender = str(rng.randrange(15550001000, 15550001100))
+            text = message_body(rng)
+            if rng.random() < 0.05:
+                sender, text = MONEY_SENDER, rng.choice(["/money give 50 lunch", "/balance"])
+            value = {
+                "contacts": [{"wa_id": sender}],
+                "messages": [{"id": next(ids), "from": sender, "type": "text", "text": {"body": text}}],
+            }
+            corpus.append(("text", webhook([value])))
+        elif roll < 0.85:
+            statuses = [
+                {"id": next(ids), "status": rng.choice(["sent", "delivered", "read"]), "recipient_id": "15550001000"}
+                for _ in range(rng.randint(1, 5))
+            ]
+            corpus.append(("statuses", webhook([{"statuses": statuses}])))
+        else:
+            values = []
+            for _ in range(rng.randint(2, 4)):
+                sender = str(rng.randrange(15550001000, 15550001100))
+                messages = [
+                    {"id": next(ids), "from": sender, "type": "text", "text": {"body": message_body(rng)}}
+                    for _ in range(rng.randint(1, 3))
+                ]
+                values.append({"contacts": [{"wa_id": sender}], "messages": messages})
+            corpus.append(("batched", webhook(values)))
+
+    return [(kind, body if isinstance(body, bytes) else json.dumps(body).encode()) for kind, body in corpus]
+
+
+def signed_headers(raw):
+    signature = hmac.new(APP_SECRET.encode(), raw, hashlib.sha256).hexdigest()
+    return {"Content-Type": "application/json", "X-Hub-Signature-256": f"sha256={signature}"}
+
+
+def replay(app, corpus, rate, clients):
+    """
+    Post the corpus, returns ([(kind, status, latency seconds)], elapsed seconds).
+    """
+    local = threading.local()
+    start = time.perf_counter()
+
+    def send(index):
+        kind, raw = corpus[index]
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        scheduled = start + index / rate if rate else None
+        if scheduled is not None:
+            time.sleep(max(scheduled - time.perf_counter(), 0))
+        sent = time.perf_counter()
+        response = client.post("/webhook", data=raw, headers=signed_headers(raw))
+        return kind, response.status_code, time.perf_counter() - (scheduled or sent)
+
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(send, range(len(corpus))))
+    return results, time.perf_counter() - start
+
+
+def percentile(sorted_values, share):
+    return sorted_values[min(int(len(sorted_values) * share), len(sorted_values) - 1)]
+
+
+def report(results, elapsed, calls):
+    print(f"{len(results)} requests in {elapsed:.2f}s, {len(results) / elapsed:.0f} req/s")
+    print(f"responses: {dict(Counter(status for _, status, _ in results))}")
+    print()
+    print(f"{'kind':<12}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    kinds = ["all"] + sorted({kind for kind, _, _ in results})
+    for kind in kinds:
+        latencies = sorted(latency for k, _, latency in results if kind in ("all", k))
+        print(
+            f"{kind:<12}{len(latencies):>7}"
+            + "".join(f"{percentile(latencies, share) * 1000:>10.1f}" for share in (0.5, 0.95, 0.99))
+            + f"{latencies[-1] * 1000:>10.1f}"
+        )
+    print()
+    print("outbound calls:")
+    for name, count in sorted(calls.items()):
+        print(f"  {name:<16}{count:>7}")
+
+
+def main():
+    args = parse_args()
+    configure_environment()
+
+    import fakeredis
+    from google.auth.credentials import AnonymousCredentials
+
+    from app import create_app
+    from app.utils.ledger import money_ledger
+    from app.utils.redis_utils import set_redis_clients
+    from app.utils.sheets import set_google_cloud_credentials
+
+    stubs = StubUpstreams(args.latency_ms / 1000)
+    stubs.start()
+
+    server = fakeredis.FakeServer()
+    set_redis_clients(fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server))
+    set_google_cloud_credentials(AnonymousCredentials())
+    app = create_app()
+
+    corpus = build_corpus(args.requests, args.duplicates, args.seed)
+    print(f"corpus: {dict(Counter(kind for kind, _ in corpus))}, stub latency {args.latency_ms:g} ms")
+
+    results, elapsed = replay(app, corpus, args.rate, args.clients)
+    # /gen, /yt and read receipts finish on the asyncio runtime after the response
+    stubs.wait_until_idle()
+    # Normally the leader copies the ledger to Sheets on a timer
+    money_ledger.flush()
+
+    report(results, elapsed, stubs.calls)
+    sys.stdout.flush()
+    # Background threads (runtime loop, stub server) are daemons, skip their teardown
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
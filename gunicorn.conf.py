@@ -0,0 +1,21 @@
+import multiprocessing
+import os
+
+# Settings can be overridden with the usual env vars (PORT, WEB_CONCURRENCY) on Heroku-style hosts
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# Handlers mostly wait on Redis and HTTP, threads let each worker overlap that waiting
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# Each worker imports the app and runs create_app() itself, so background threads
+# (scheduler, reminder dispatcher, asyncio runtime) are started in every worker
+# rather than in the master where they would not survive fork().
+preload_app = False
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
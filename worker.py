@@ -0,0 +1,20 @@
+import logging
+import signal
+import threading
+
+from app import create_app
+from app.utils.message_queue import run_worker
+
+app = create_app()
+stop_event = threading.Event()
+
+
+def shutdown(signum, frame):
+    logging.info("Worker shutting down")
+    stop_event.set()
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    run_worker(app, stop_event)